@@ -3,14 +3,81 @@
 import os
 import shutil
 import subprocess
+import hashlib
+import stat
+import mmap
+import io
+import json
+import heapq
+import logging
+from contextlib import contextmanager
+from urllib.parse import urlsplit, unquote, urlencode
+from collections import namedtuple
+import re
+import sys
+import time
+import signal
+import argparse
+import fnmatch
+import importlib.util
+import copy
+import random
+import threading
+import queue
+from itertools import repeat
 from pathlib import Path
-from ruamel.yaml import YAML
-import git
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
-yaml = YAML()
-yaml.preserve_quotes = True
-yaml.indent(mapping=2, sequence=4, offset=2)
+log = logging.getLogger("k8zilla")
+
+
+class LazyModule:
+    # Stands in for a module until one of its attributes is first used, so
+    # commands that never touch git (validate-config, harden-file, --help)
+    # do not pay for importing GitPython, and --help not even for ruamel.
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)
+        return value
+
+
+git = LazyModule("git")
+git_fun = LazyModule("git.objects.fun")
+gitdb_base = LazyModule("gitdb.base")
+ruamel_yaml = LazyModule("ruamel.yaml")
+ruamel_comments = LazyModule("ruamel.yaml.comments")
+concurrent_futures = LazyModule("concurrent.futures")
+multiprocessing = LazyModule("multiprocessing")
+pyyaml = LazyModule("yaml")
+http_client = LazyModule("http.client")
+
+
+def make_yaml():
+    parser = ruamel_yaml.YAML()
+    parser.preserve_quotes = True
+    parser.indent(mapping=2, sequence=4, offset=2)
+    return parser
+
+# Part of the transform cache key; bump it whenever a rule changes its output
+# or the cache entry format changes (cached entries hold the rule hit counts too)
+TOOL_VERSION = "5"
+
+# ruamel YAML instances are not thread safe, so each pipeline worker gets its own
+_thread_state = threading.local()
+STOP = object()
+
+
+def thread_yaml():
+    if not hasattr(_thread_state, "yaml"):
+        _thread_state.yaml = make_yaml()
+    return _thread_state.yaml
 
 
 def read_env_variable():
@@ -21,188 +88,2694 @@ def read_env_variable():
     return PAT
 
 
-def read_project_file():
-    with open("projects.yaml", 'r') as f:
-        project_data = yaml.load(f)
+def read_project_file(path="projects.yaml"):
+    with open(path, 'r') as f:
+        project_data = make_yaml().load(f)
     return project_data
 
 
-def clone_repo(url, PAT, source_branch):
-    clone_url = url.replace("https://", f"https://{PAT}@")
-    repo_name = url.split("/")[-1].replace(".git", "")
-    if Path(repo_name).exists():
-        shutil.rmtree(repo_name)
-    repo = git.Repo.clone_from(clone_url, repo_name)
+def load_settings(project_data, use_transform_cache=True):
+    settings = {
+        'switches': project_data.get('switches', {}),
+        'api_migration_pathway': project_data.get('api_migration_pathway', []),
+        'pod_specs': project_data.get('pod_specs', []),
+        'source_branch': project_data.get('source_branch', 'main'),
+        'target_branch': project_data.get('target_branch', 'feature_k8s_hardening'),
+        'pipeline': project_data.get('pipeline', {}),
+        'clone': project_data.get('clone', {}),
+        'discovery': project_data.get('discovery', {}),
+        'transform': project_data.get('transform', {}),
+        'commit': project_data.get('commit', {}),
+        'preflight': project_data.get('preflight', {}),
+        'mirror_cache': mirror_cache_settings(project_data.get('mirror_cache', {})),
+        'git_backend': make_git_backend(project_data.get('git_backend', 'gitpython')),
+        'profile': profile_settings(project_data.get('profile', {})),
+        'pull_requests': pull_request_settings(project_data.get('pull_requests', {})),
+    }
+    remote_scheduler.configure(project_data.get('remote', {}))
+    settings['rules'] = compile_rules(settings['switches'], settings['api_migration_pathway'], settings['pod_specs'])
+    if settings['transform'].get('prefilter', 'on') == 'on':
+        settings['prefilter'] = build_prefilter(settings['rules'])
+    else:
+        settings['prefilter'] = None
+    settings['analysis'] = settings['transform'].get('analysis', 'on') == 'on'
+    if settings['analysis'] and importlib.util.find_spec("yaml") is None:
+        print("transform.analysis needs PyYAML, every candidate file goes through ruamel instead.")
+        settings['analysis'] = False
+    transform_cache = project_data.get('transform_cache', {})
+    if use_transform_cache and transform_cache.get('enabled', 'off') == 'on':
+        settings['transform_cache'] = transform_cache_settings(transform_cache, settings['switches'],
+                                                               settings['api_migration_pathway'],
+                                                               settings['transform'].get('writer', 'patch'),
+                                                               settings['pod_specs'])
+        if transform_cache.get('clear', 'off') == 'on' and Path(settings['transform_cache']['path']).exists():
+            # before any lookup, so none of the dropped entries is served again
+            print(f"Clearing transform cache {settings['transform_cache']['path']}")
+            shutil.rmtree(settings['transform_cache']['path'])
+    else:
+        settings['transform_cache'] = None
+    return settings
+
+
+def mirror_cache_settings(mirror_cache):
+    mirror_cache = dict(mirror_cache)
+    # resolved up front because main() chdirs into temp_repos afterwards
+    mirror_cache['path'] = os.path.abspath(os.path.expanduser(mirror_cache.get('path', 'mirror_cache')))
+    return mirror_cache
+
+
+def pull_request_settings(pull_requests):
+    pull_requests = dict(pull_requests)
+    if pull_requests.get('etag_cache'):
+        pull_requests['etag_cache'] = os.path.abspath(os.path.expanduser(pull_requests['etag_cache']))
+    return pull_requests
+
+
+def repo_name_from_url(url):
+    return url.split("/")[-1].replace(".git", "")
+
+
+def clone_url_for(url, PAT):
+    return url.replace("https://", f"https://{PAT}@")
+
+
+def clone_options_for(repo, settings):
+    # A repo entry may carry its own 'clone' block that overrides the global one
+    options = dict(settings.get('clone', {}))
+    options.update(repo.get('clone', {}))
+    return options
+
+
+def discovery_for(repo, settings):
+    # ... and its own 'discovery' block the same way
+    options = dict(settings.get('discovery', {}))
+    options.update(repo.get('discovery', {}))
+    return options
+
+
+_mirror_locks = {}
+_mirror_locks_guard = threading.Lock()
+
+
+def mirror_path_for(url, cache_dir):
+    # content addressed by the remote URL so two repos with the same name in
+    # different projects never share a mirror
+    digest = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{repo_name_from_url(url)}-{digest}.git")
+
+
+def mirror_lock(mirror_path):
+    with _mirror_locks_guard:
+        return _mirror_locks.setdefault(mirror_path, threading.Lock())
+
+
+def update_mirror(url, clone_url, mirror_cache):
+    mirror_path = mirror_path_for(url, mirror_cache['path'])
+    with mirror_lock(mirror_path):
+        if Path(mirror_path).exists():
+            mirror = git.Repo(mirror_path)
+        else:
+            Path(mirror_cache['path']).mkdir(parents=True, exist_ok=True)
+            mirror = git.Repo.init(mirror_path, bare=True)
+            # the plain URL is kept for eviction; the PAT is never written to disk
+            mirror.git.config('k8zilla.url', url)
+        mirror.git.fetch(clone_url, '+refs/heads/*:refs/heads/*', '--prune', '--no-tags')
+        if mirror_cache.get('maintenance', 'on') == 'on':
+            # gc --auto only repacks once enough loose objects/packs pile up
+            mirror.git.gc('--auto')
+            mirror.git.commit_graph('write', '--reachable')
+        Path(mirror_path, 'k8zilla-last-used').touch()
+    return mirror_path
+
+
+def clone_from_mirror(url, clone_url, repo_name, source_branch, clone_options, mirror_cache):
+    mirror_path = update_mirror(url, clone_url, mirror_cache)
+    if clone_options.get("strategy", "full") == "bare":
+        repo = git.Repo.clone_from(mirror_path, repo_name, shared=True, bare=True, branch=source_branch)
+        repo.remote('origin').set_url(clone_url)
+        return repo_name
+    sparse = clone_options.get("strategy", "full") == "sparse"
+    # --shared borrows the mirror's objects through alternates, so the working
+    # copy costs a checkout and nothing else
+    repo = git.Repo.clone_from(mirror_path, repo_name, shared=True, branch=source_branch, no_checkout=sparse)
+    repo.remote('origin').set_url(clone_url)
+    if sparse:
+        repo.git.sparse_checkout('set', '--no-cone', *clone_options.get("sparse_paths", MANIFEST_GLOBS))
     repo.git.checkout(source_branch)
     return repo_name
 
 
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
 
-def get_containers_from_content(content):
-    kind = content.get('kind', '')
-    spec = content.get('spec', {})
-    
-    if kind in ['Deployment', 'StatefulSet', 'DaemonSet']:
-        template_spec = spec.get('template', {}).get('spec', {})
-    
-    elif kind in ['CronJob']:
-        template_spec = spec.get('jobTemplate', {}).get('spec', {}).get('template', {}).get('spec', {})
-    
-    elif kind in ['Job']:
-        template_spec = spec.get('template', {}).get('spec', {})
-    
-    else:
+
+def mirror_last_used(mirror_path):
+    try:
+        return os.path.getmtime(os.path.join(mirror_path, 'k8zilla-last-used'))
+    except OSError:
+        return 0
+
+
+def evict_mirrors(mirror_cache, urls=None):
+    # urls=None (the daemon, which has no repo list) only applies max_size_mb
+    cache_dir = mirror_cache['path']
+    if not Path(cache_dir).exists():
+        return
+    mirrors = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.git')]
+
+    if urls is not None:
+        wanted = {mirror_path_for(url, cache_dir) for url in urls}
+        for mirror_path in mirrors:
+            if mirror_path not in wanted:
+                print(f"Evicting mirror {mirror_path}, repo is no longer in projects.yaml")
+                shutil.rmtree(mirror_path)
+        mirrors = [mirror_path for mirror_path in mirrors if mirror_path in wanted and Path(mirror_path).exists()]
+
+    max_size_mb = mirror_cache.get('max_size_mb')
+    if max_size_mb is None:
+        return
+    sizes = {mirror_path: dir_size(mirror_path) for mirror_path in mirrors}
+    total = sum(sizes.values())
+    # least recently used first
+    for mirror_path in sorted(mirrors, key=mirror_last_used):
+        if total <= int(max_size_mb) * 1024 * 1024:
+            break
+        print(f"Evicting mirror {mirror_path}, cache is over {max_size_mb} MB")
+        shutil.rmtree(mirror_path)
+        total -= sizes[mirror_path]
+
+
+# Remote git operations (clone, mirror fetch, ls-remote, push) go through
+# remote_scheduler.call. Per host, a token bucket spaces them out to
+# rate_per_second with bursts of burst and at most max_concurrent run at
+# once. Failures git reports as transient (timeouts, resets, 5xx, 429) are
+# retried with exponential backoff and full jitter; authentication errors
+# and missing repos or branches are permanent and raised at once, as is
+# anything not recognised. Retries are counted per repo URL and end up in
+# the repo's report record. Local remotes (file://, paths) are not limited.
+
+PERMANENT_GIT_ERRORS = re.compile(
+    r"authentication failed|could not read (username|password)|permission denied|invalid credentials"
+    r"|repository not found|does not appear to be a git repository|not found in upstream"
+    r"|couldn't find remote ref|remote branch .* not found|returned error: 40[134]"
+    r"|stale info|already exists|\[rejected\]|certificate", re.IGNORECASE)
+TRANSIENT_GIT_ERRORS = re.compile(
+    r"timed out|timeout|connection (reset|refused|closed)|failed to connect|couldn't connect"
+    r"|could not resolve host|temporary failure"
+    r"|early eof|remote end hung up|rpc failed|returned error: (429|5\d\d)|too many requests"
+    r"|http/2 stream|unexpected disconnect|\b(gnu)?tls\b|\bssl\b|broken pipe|service unavailable", re.IGNORECASE)
+
+
+def is_transient_git_error(error):
+    message = str(error)
+    if PERMANENT_GIT_ERRORS.search(message):
+        return False
+    return TRANSIENT_GIT_ERRORS.search(message) is not None
+
+
+def host_for(url):
+    parts = urlsplit(url)
+    if parts.scheme:
+        return parts.hostname if parts.scheme != "file" else None
+    match = re.match(r"^[^@/]+@([^:/]+):", url)  # scp-like git@host:owner/repo
+    return match.group(1) if match else None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RemoteScheduler:
+    def __init__(self, remote=None):
+        self.configure(remote or {})
+
+    def configure(self, remote):
+        self.remote = remote
+        self.max_retries = int(remote.get('max_retries', 4))
+        self.backoff_seconds = float(remote.get('backoff_seconds', 1))
+        self.max_backoff_seconds = float(remote.get('max_backoff_seconds', 30))
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._retries = {}
+
+    def _limits(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                limits = dict(self.remote, **(self.remote.get('hosts') or {}).get(host, {}))
+                self._hosts[host] = (TokenBucket(float(limits.get('rate_per_second', 2)), int(limits.get('burst', 4))),
+                                     threading.BoundedSemaphore(int(limits.get('max_concurrent', 4))))
+            return self._hosts[host]
+
+    def backoff(self, attempt):
+        # full jitter: anywhere between 0 and the exponential ceiling
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def call(self, url, operation, fn, *args):
+        host = host_for(url) if url else None
+        if host is None:
+            return fn(*args)
+        bucket, slots = self._limits(host)
+        for attempt in range(self.max_retries + 1):
+            bucket.take()
+            try:
+                with slots:
+                    return fn(*args)
+            except git_errors() as e:
+                if attempt == self.max_retries or not is_transient_git_error(e):
+                    raise
+                delay = self.backoff(attempt)
+                lines = str(e).strip().splitlines()
+                log.warning("%s of %s failed, retry %d/%d in %.1fs: %s", operation, url, attempt + 1,
+                            self.max_retries, delay, lines[-1] if lines else type(e).__name__)
+                with self._lock:
+                    retries = self._retries.setdefault(url, {})
+                    retries[operation] = retries.get(operation, 0) + 1
+                count("remote_retries")
+                time.sleep(delay)
+
+    def take_retries(self, url):
+        with self._lock:
+            return self._retries.pop(url, {})
+
+
+remote_scheduler = RemoteScheduler()
+
+
+def clone_repo(url, PAT, source_branch, clone_options=None, mirror_cache=None, backend=None):
+    backend = backend or GIT_BACKENDS["gitpython"]()
+    clone_options = clone_options or {}
+    clone_url = clone_url_for(url, PAT)
+    repo_name = repo_name_from_url(url)
+
+    def attempt():
+        # a failed attempt can leave a partial clone behind
+        if Path(repo_name).exists():
+            shutil.rmtree(repo_name)
+        if mirror_cache and mirror_cache.get('enabled', 'off') == 'on':
+            # mirrors are maintained with the git CLI whichever backend is selected
+            return clone_from_mirror(url, clone_url, repo_name, source_branch, clone_options, mirror_cache)
+        return backend.clone(clone_url, repo_name, source_branch, clone_options)
+    return remote_scheduler.call(url, "clone", attempt)
+
+
+# Where each kind keeps its pod spec: (apiVersion, kind) -> keys leading
+# from the document to the spec, None as apiVersion for every version of the
+# kind. The pod_specs entries of projects.yaml are added on top (CRDs, or
+# overrides), and compile_rules resolves the whole table into
+# kind -> {apiVersion: path} once per run, so finding the containers of a
+# document is a lookup and a fixed walk however many kinds are registered.
+
+POD_SPEC_PATHS = {
+    (None, 'Pod'): ('spec',),
+    (None, 'PodTemplate'): ('template', 'spec'),
+    (None, 'ReplicationController'): ('spec', 'template', 'spec'),
+    (None, 'ReplicaSet'): ('spec', 'template', 'spec'),
+    (None, 'Deployment'): ('spec', 'template', 'spec'),
+    (None, 'StatefulSet'): ('spec', 'template', 'spec'),
+    (None, 'DaemonSet'): ('spec', 'template', 'spec'),
+    (None, 'Job'): ('spec', 'template', 'spec'),
+    (None, 'CronJob'): ('spec', 'jobTemplate', 'spec', 'template', 'spec'),
+    ('argoproj.io/v1alpha1', 'Rollout'): ('spec', 'template', 'spec'),
+}
+POD_CONTAINER_FIELDS = ('containers', 'initContainers', 'ephemeralContainers')
+
+
+def compile_pod_specs(pod_specs):
+    table = dict(POD_SPEC_PATHS)
+    for entry in pod_specs:
+        path = entry['path']
+        table[(entry.get('api_version'), entry['kind'])] = tuple(path.split('.') if isinstance(path, str) else path)
+    locators = {}
+    for (api_version, kind), path in table.items():
+        locators.setdefault(kind, {})[api_version] = path
+    return locators
+
+
+def pod_spec_containers(content, paths):
+    # paths is the apiVersion -> path entry of the document's kind
+    path = paths.get(content.get('apiVersion'))
+    if path is None:
+        path = paths.get(None)
+        if path is None:
+            return []
+    spec = content
+    for key in path:
+        spec = spec.get(key) if isinstance(spec, dict) else None
+    if not isinstance(spec, dict):
         return []
-    
-    containers = template_spec.get('containers', [])
-    init_containers = template_spec.get('initContainers', [])
-    
-    return containers + init_containers  # concatenate the lists and return
+    return [container for field in POD_CONTAINER_FIELDS for container in spec.get(field) or []
+            if isinstance(container, dict)]
+
 
+# Hardening rules. Each rule is tied to a switch in projects.yaml and declares
+# the kinds it applies to (None for every kind, or for container rules every
+# kind with a pod spec). Container rules run once per container with its
+# securityContext, document rules once per document.
+# compile_rules turns the enabled ones into a kind -> rules table once per
+# run, so a document costs one dict lookup however many rules exist.
+# Adding a rule is a matter of decorating a handler below.
+
+Rule = namedtuple("Rule", ["switch", "kinds", "handler", "container", "prefilter"])
+RULES = []
+
+
+def hardening_rule(switch, kinds=None, container=False, prefilter=None):
+    def register(handler):
+        RULES.append(Rule(switch, kinds, handler, container, prefilter))
+        return handler
+    return register
+
+
+@hardening_rule("vault_command", container=True)
+def vault_command(container, security_context, edits, options):
+    if "vault" in container.get("image", ""):
+        if "command" not in container:
+            set_key(container, 'command', ["vault"], edits)
+            return True
+    return False
+
+
+@hardening_rule("nonroot", container=True)
+def nonroot(container, security_context, edits, options):
+    if security_context.get('runAsNonRoot') is True:
+        return False
+    log.debug("runAsNonRoot: %s", container.get("name"))
+    set_key(security_context, 'runAsNonRoot', True, edits)
+    return True
+
+
+@hardening_rule("remove_rootaszero", container=True)
+def remove_rootaszero(container, security_context, edits, options):
+    if security_context.get('runAsUser') == 0:
+        log.debug("remove runAsUser 0: %s", container.get("name"))
+        delete_key(security_context, 'runAsUser', edits)
+        return True
+    return False
+
+
+@hardening_rule("previlege_escalation", container=True)
+def previlege_escalation(container, security_context, edits, options):
+    if security_context.get('allowPrivilegeEscalation') is False:
+        return False
+    log.debug("allowPrivilegeEscalation: %s", container.get("name"))
+    set_key(security_context, 'allowPrivilegeEscalation', False, edits)
+    return True
 
-def apply_switches(all_content, switches, api_migration_pathway):
+
+def compile_api_migrations(api_migration_pathway):
+    # (from_api_version, kind) -> (final to_api_version, strategy). Kinds are
+    # matched case-insensitively; an entry without a kind applies to every
+    # kind. Chains such as v1alpha1 -> v1beta1 -> v1 are followed here, once,
+    # so upgrading a document is a single lookup.
+    hops = {}
+    for api_path in api_migration_pathway:
+        kind = api_path.get("kind")
+        key = (api_path.get("from_api_version", ""), kind.lower() if kind else None)
+        hops[key] = (api_path.get("to_api_version", ""), api_path.get("strategy", ""))
+
+    def next_hop(api_version, kind):
+        return hops.get((api_version, kind)) or hops.get((api_version, None))
+
+    # a chain is followed per kind, so a hop without a kind can lead on to
+    # one that only applies to some kinds; None covers every other kind
+    kinds = {kind for _, kind in hops} | {None}
+    migrations = {}
+    for api_version in {api_version for api_version, _ in hops}:
+        for kind in kinds:
+            hop = next_hop(api_version, kind)
+            if hop is None:
+                continue
+            seen = {api_version}
+            strategies = []
+            target = api_version
+            while hop is not None:
+                target, strategy = hop
+                strategies.append(strategy)
+                if target in seen:
+                    raise ValueError(f"api_migration_pathway has a cycle through {target} for kind {kind or '*'}")
+                seen.add(target)
+                hop = next_hop(target, kind)
+            strategy = "kubectl_convert" if "kubectl_convert" in strategies else strategies[-1]
+            migrations[(api_version, kind)] = (target, strategy)
+    return migrations
+
+
+def upgrade_apis_prefilter(options):
+    versions = sorted({api_version for api_version, _ in options['api_migrations'] if api_version})
+    if not versions:
+        return None
+    versions = b"|".join(re.escape(version.encode()) for version in versions)
+    return rb"\bapiVersion[\"']?\s*:\s*[\"']?(?:" + versions + rb")(?![\w./-])"
+
+
+@hardening_rule("upgrade_apis", prefilter=upgrade_apis_prefilter)
+def upgrade_apis(content, edits, options):
+    api_version = content.get("apiVersion", "")
+    kind = str(content.get("kind", "")).lower()
+    migrations = options['api_migrations']
+    migration = migrations.get((api_version, kind)) or migrations.get((api_version, None))
+    if migration is None:
+        return False
+    to_api_version, strategy = migration
+    set_key(content, "apiVersion", to_api_version, edits)
+    if not options.get("quiet"):
+        log.info("%s %s: %s -> %s", content.get("kind"), content.get("metadata", {}).get("name"),
+                 api_version, to_api_version)
+    if strategy == "kubectl_convert":
+        # Here you would call `kubectl convert` using subprocess or similar
+        pass
+    return True
+
+
+def split_rules(rules):
+    return (tuple(rule for rule in rules if rule.container),
+            tuple(rule for rule in rules if not rule.container))
+
+
+def rule_applies(rule, kind, locators):
+    if rule.kinds is not None:
+        return kind in rule.kinds
+    return not rule.container or kind in locators
+
+
+def compile_rules(switches, api_migration_pathway, pod_specs=()):
+    # by_kind and default are (container rules, document rules, pod spec paths)
+    enabled = [rule for rule in RULES if switches.get(rule.switch, "off") == "on"]
+    locators = compile_pod_specs(pod_specs)
+    any_kind = [rule for rule in enabled if rule.kinds is None and not rule.container]
+    kinds = {kind for rule in enabled if rule.kinds for kind in rule.kinds}
+    if any(rule.container and rule.kinds is None for rule in enabled):
+        kinds.update(locators)
+    by_kind = {}
+    for kind in kinds:
+        # registration order is kept, so rules always run in the same order
+        by_kind[kind] = split_rules([rule for rule in enabled if rule_applies(rule, kind, locators)]) + \
+            (locators.get(kind, {}),)
+    return {
+        "by_kind": by_kind,
+        "default": split_rules(any_kind) + ({},),
+        "options": {"api_migrations": compile_api_migrations(api_migration_pathway)},
+    }
+
+
+def apply_rules(all_content, rules, edits=None, hits=None):
+    # hits, when given, counts per switch how often a rule changed something
     global_modified = False
+    options = rules["options"]
     for content in all_content:
         modified = False
-        if 'kind' in content:  # Syntax was incomplete, added a colon
-            if content['kind'] in ['Deployment', 'StatefulSet', 'CronJob', 'Job' 'DaemonSet']:
-                containers = get_containers_from_content(content)
-                print("cat")
-                print(containers)
-                #containers = content.get('spec', {}).get('template', {}).get('spec', {}).get('containers', [])
+        if isinstance(content, dict) and 'kind' in content:
+            container_rules, document_rules, pod_spec_paths = rules["by_kind"].get(content['kind'], rules["default"])
+            if container_rules:
+                containers = pod_spec_containers(content, pod_spec_paths)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("%s containers: %s", content['kind'], [c.get('name') for c in containers])
                 for container in containers:
                     security_context = container.get('securityContext', {})  # Initialize security_context
-
-                    if switches.get("vault_command", "off") == "on":
-                        if "vault" in container.get("image", ""):
-                            if "command" not in container:
-                                container['command'] = ["vault"]
-                                modified = True
-
-                    if switches.get("nonroot", "off") == "on":
-                        print("Implement runAsNonRoot")
-                        security_context['runAsNonRoot'] = True
-                        modified = True
-
-                    # New Code Block to remove runAsUser: 0
-                    if switches.get("remove_rootaszero", "off") == "on":
-                        print("Implement Remove Root User assigned as 0")
-                        if security_context.get('runAsUser') == 0:
-                            del security_context['runAsUser']
+                    for rule in container_rules:
+                        if rule.handler(container, security_context, edits, options):
                             modified = True
-
-                    if switches.get("previlege_escalation", "off") == "on":
-                        print("Implement allowPrivilegeEscalation")
-                        security_context['allowPrivilegeEscalation'] = False
-                        modified = True
-
-                    container['securityContext'] = security_context  # Update the securityContext in the container
-
-            if switches.get("upgrade_apis", "off") == "on":
-                # Implement API version upgrade
-                api_version = content.get("apiVersion", "")
-                print(api_version)
-                for api_path in api_migration_pathway:
-                    if api_version == api_path.get("from_api_version", ""):
-                        content["apiVersion"] = api_path.get("to_api_version", "")
-                        print(content["apiVersion"])
-                        strategy = api_path.get("strategy", "")
-                        if strategy == "kubectl_convert":
-                            # Here you would call `kubectl convert` using subprocess or similar
-                            pass
-                        modified = True
-
-        # ... (snip) ... The body of the old 'apply_switches' goes here
-        # ... (snip) ... Just remember to set 'modified = True' wherever you make changes
+                            if hits is not None:
+                                hits[rule.switch] = hits.get(rule.switch, 0) + 1
+                    if 'securityContext' not in container and security_context:
+                        set_key(container, 'securityContext', security_context, edits)  # Update the securityContext in the container
+            for rule in document_rules:
+                if rule.handler(content, edits, options):
+                    modified = True
+                    if hits is not None:
+                        hits[rule.switch] = hits.get(rule.switch, 0) + 1
         global_modified = global_modified or modified
     return global_modified
 
 
-def create_branch_and_commit(repo_name, target_branch):
-    repo = git.Repo(repo_name)
-    repo.git.fetch('origin')
+# Minimal-edit writer: apply_rules records every change a rule makes through
+# set_key/delete_key as an edit against the mapping it touched, and
+# render_edits turns those into line/column patches on the original text
+# using ruamel's parse marks
+# (mapping.lc.data[key] == [key_line, key_col, value_line, value_col]).
+# Anything the patcher cannot place safely (flow mappings, multi-line values
+# being replaced, ...) makes render_edits return None and the caller falls
+# back to a full ruamel dump.
+
+PLAIN_SCALAR = re.compile(r"^[A-Za-z0-9_./-]+$")
+RESERVED_SCALARS = {"true", "false", "yes", "no", "on", "off", "null", "~", "y", "n"}
+
+
+def set_key(mapping, key, value, edits):
+    if edits is not None and isinstance(mapping, ruamel_comments.CommentedMap):
+        if key not in mapping or mapping[key] != value:
+            edits.append(("set", mapping, key))
+    mapping[key] = value
+
+
+def delete_key(mapping, key, edits):
+    if edits is not None and isinstance(mapping, ruamel_comments.CommentedMap):
+        edits.append(("delete", mapping, key))
+    del mapping[key]
+
+
+def render_scalar(value, quote=None):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    value = str(value)
+    if quote == "'":
+        return "'" + value.replace("'", "''") + "'"
+    if quote == '"' or not PLAIN_SCALAR.match(value) or value.lower() in RESERVED_SCALARS:
+        return json.dumps(value)
+    return value
+
+
+def render_entry(key, value, col, newline):
+    pad = " " * col
+    if isinstance(value, dict):
+        if not value:
+            return [f"{pad}{key}: {{}}{newline}"]
+        lines = [f"{pad}{key}:{newline}"]
+        for child_key, child_value in value.items():
+            lines.extend(render_entry(child_key, child_value, col + 2, newline))
+        return lines
+    if isinstance(value, list):
+        if any(isinstance(item, (dict, list)) for item in value):
+            return None
+        items = ", ".join(render_scalar(item, '"') for item in value)
+        return [f"{pad}{key}: [{items}]{newline}"]
+    return [f"{pad}{key}: {render_scalar(value)}{newline}"]
+
+
+def line_indent(line):
+    return len(line) - len(line.lstrip(' '))
+
+
+def block_end(lines, line, col):
+    # first line after the entry starting at `line` whose key sits at `col`;
+    # a block sequence may share the key's indentation
+    end = line + 1
+    for index in range(line + 1, len(lines)):
+        stripped = lines[index].strip()
+        if not stripped:
+            continue
+        indent = line_indent(lines[index])
+        if indent > col or (indent == col and (stripped.startswith('- ') or stripped == '-')):
+            end = index + 1
+            continue
+        break
+    return end
+
+
+def scalar_span(line, col):
+    text = line.rstrip('\r\n')
+    if col >= len(text):
+        return None
+    if text[col] in "\"'":
+        match = re.compile(r'"(?:[^"\\]|\\.)*"' if text[col] == '"' else r"'(?:[^']|'')*'").match(text, col)
+    else:
+        match = re.compile(r"[^#\s](?:[^#]*?[^#\s])?(?=\s+#|\s*$)").match(text, col)
+    if match is None:
+        return None
+    return match.start(), match.end()
+
+
+def render_edits(text, edits):
+    lines = text.splitlines(keepends=True)
+    newline = "\r\n" if lines and lines[0].endswith("\r\n") else "\n"
+    inserts = {}
+    deleted = set()
+    replacements = {}
+
+    for order, (action, mapping, key) in enumerate(edits):
+        marks = mapping.lc.data
+        if not marks or mapping.fa.flow_style():
+            return None
+        key_col = next(iter(marks.values()))[1]
+        if action == "delete":
+            if key not in marks:
+                return None
+            key_line = marks[key][0]
+            if lines[key_line][:key_col].strip() or not mapping:
+                return None  # first key of a "- key:" item, or nothing left
+            deleted.update(range(key_line, block_end(lines, key_line, key_col)))
+        elif key not in mapping:
+            continue
+        elif key in marks:
+            key_line, _, value_line, value_col = marks[key]
+            value = mapping[key]
+            if value_line != key_line or isinstance(value, (dict, list)):
+                return None
+            span = scalar_span(lines[value_line], value_col)
+            if span is None:
+                return None
+            original = lines[value_line][span[0]:span[1]]
+            quote = original[0] if original[0] in "\"'" and isinstance(value, str) else None
+            replacements.setdefault(value_line, []).append((span[0], span[1], render_scalar(value, quote)))
+        else:
+            rendered = render_entry(key, mapping[key], key_col, newline)
+            if rendered is None:
+                return None
+            last_line = max(mark[0] for mark in marks.values())
+            end = block_end(lines, last_line, key_col)
+            # deeper mappings go first when two inserts land on the same line
+            inserts.setdefault(end, []).append((-key_col, order, rendered))
+
+    output = []
+    for index in range(len(lines) + 1):
+        if index in inserts:
+            if output and not output[-1].endswith("\n"):
+                output[-1] += newline
+            for _, _, rendered in sorted(inserts[index]):
+                output.extend(rendered)
+        if index == len(lines):
+            break
+        line = lines[index]
+        if index in deleted:
+            if index in replacements:
+                return None
+            continue
+        for start, end, replacement in sorted(replacements.get(index, []), reverse=True):
+            line = line[:start] + replacement + line[end:]
+        output.append(line)
+    return "".join(output)
+
+
+COMMIT_MESSAGE = 'Harden Kubernetes configurations'
+
+
+def create_branch_and_commit(repo_name, target_branch, check_remote=True, backend=None, on_commit=None, url=None):
+    # Returns (commit sha, None) once pushed, or (None, why the repo was skipped).
+    # on_commit(sha) runs between the commit and the push. url, when given,
+    # puts the remote calls under remote_scheduler's limits and retries.
+    backend = backend or GIT_BACKENDS["gitpython"]()
+    try:
+        # Skipped when the preflight already saw that target_branch is absent
+        if check_remote and remote_scheduler.call(url, "ls-remote", backend.remote_has_branch, repo_name,
+                                                  target_branch):
+            reason = f"{target_branch} branch already exists in remote for {repo_name}"
+            print(f"{reason}, skipping...")
+            return None, reason
+        backend.create_branch(repo_name, target_branch)
+        commit = backend.commit_all(repo_name, COMMIT_MESSAGE)
+        if on_commit is not None:
+            on_commit(commit)
+        remote_scheduler.call(url, "push", backend.push, repo_name, target_branch)
+    except git_errors() as e:
+        print(f"An error occurred: {str(e)}, skipping...")
+        return None, f"An error occurred: {str(e)}"
+    return commit, None
+
+
+def commit_with_plumbing(repo_name, source_branch, target_branch, changes, check_remote=True, backend=None,
+                         on_commit=None, url=None):
+    # changes maps repo-relative paths to their new bytes. Only the trees on
+    # those paths are rewritten; no checkout, no index, no `add -A` walk.
+    backend = backend or GIT_BACKENDS["gitpython"]()
+    try:
+        if check_remote and remote_scheduler.call(url, "ls-remote", backend.remote_has_branch, repo_name,
+                                                  target_branch):
+            reason = f"{target_branch} branch already exists in remote for {repo_name}"
+            print(f"{reason}, skipping...")
+            return None, reason
+        commit = backend.commit_files(repo_name, source_branch, target_branch, nest_changes(changes),
+                                      COMMIT_MESSAGE)
+        if on_commit is not None:
+            on_commit(commit)
+        remote_scheduler.call(url, "push", backend.push, repo_name, target_branch)
+    except git_errors() as e:
+        print(f"An error occurred: {str(e)}, skipping...")
+        return None, f"An error occurred: {str(e)}"
+    return commit, None
+
+
+def store_object(repo, object_type, data):
+    # written straight into the object database, no `git hash-object` fork
+    return repo.odb.store(gitdb_base.IStream(object_type, len(data), io.BytesIO(data))).binsha
+
+
+def write_tree(repo, tree_binsha, changes):
+    # changes maps a name to new blob bytes, or to a nested dict for a
+    # subdirectory; untouched entries are reused from the existing tree
+    entries = {}
+    if tree_binsha is not None:
+        for binsha, mode, name in git_fun.tree_entries_from_data(repo.odb.stream(tree_binsha).read()):
+            entries[name] = (binsha, mode)
+    for name, change in changes.items():
+        if isinstance(change, dict):
+            existing = entries.get(name)
+            subtree = existing[0] if existing and stat.S_ISDIR(existing[1]) else None
+            entries[name] = (write_tree(repo, subtree, change), stat.S_IFDIR)
+        else:
+            mode = entries[name][1] if name in entries else 0o100644
+            entries[name] = (store_object(repo, b"blob", change), mode)
+    # git orders tree entries as if directory names ended in "/"
+    ordered = sorted(entries.items(), key=lambda item: item[0] + "/" if stat.S_ISDIR(item[1][1]) else item[0])
+    buffer = io.BytesIO()
+    git_fun.tree_to_stream([(binsha, mode, name) for name, (binsha, mode) in ordered], buffer.write)
+    return store_object(repo, b"tree", buffer.getvalue())
+
+
+def nest_changes(changes):
+    # {"a/b/c.yaml": data} -> {"a": {"b": {"c.yaml": data}}}
+    nested = {}
+    for path, data in changes.items():
+        *directories, name = path.split("/")
+        node = nested
+        for directory in directories:
+            node = node.setdefault(directory, {})
+        node[name] = data
+    return nested
+
+
+# Git backends. clone_repo, create_branch_and_commit, commit_with_plumbing and
+# the bare-clone reader only talk to git through one of these, picked by
+# git_backend in projects.yaml:
+#   gitpython - the git CLI through GitPython, one subprocess per command
+#   pygit2    - libgit2 in-process, repository handles kept open per repo
+# Both raise one of git_errors() when an operation fails.
+
+class GitBackendError(Exception):
+    pass
+
+
+def git_errors():
+    # a function rather than a constant so importing k8zilla does not import
+    # GitPython; except clauses only evaluate it once something was raised
+    return (git.exc.GitCommandError, GitBackendError)
+
+
+class GitPythonBackend:
+    def clone(self, clone_url, repo_name, source_branch, clone_options):
+        strategy = clone_options.get("strategy", "full")
+        if strategy == "shallow":
+            # Only the tip of source_branch; pushing a new branch on top of it still
+            # works because the remote already has the parent commit
+            repo = git.Repo.clone_from(clone_url, repo_name, depth=1, branch=source_branch, single_branch=True)
+        elif strategy == "blobless":
+            repo = git.Repo.clone_from(clone_url, repo_name, filter="blob:none", branch=source_branch)
+        elif strategy == "sparse":
+            # Blobless + sparse: only the blobs of manifest paths are ever fetched
+            repo = git.Repo.clone_from(clone_url, repo_name, filter="blob:none", branch=source_branch,
+                                       no_checkout=True)
+            sparse_paths = clone_options.get("sparse_paths", MANIFEST_GLOBS)
+            repo.git.sparse_checkout('set', '--no-cone', *sparse_paths)
+        elif strategy == "bare":
+            # no working tree at all: manifests are read from blobs and committed
+            # with plumbing (see commit_with_plumbing)
+            git.Repo.clone_from(clone_url, repo_name, bare=True, depth=1, branch=source_branch, single_branch=True)
+            return repo_name
+        elif strategy == "full":
+            repo = git.Repo.clone_from(clone_url, repo_name)
+        else:
+            raise ValueError(f"Unknown clone strategy {strategy} for {repo_name}")
+        repo.git.checkout(source_branch)
+        return repo_name
+
+    def remote_has_branch(self, repo_name, branch):
+        # ls-remote rather than fetch + branch -r: single-branch clones never
+        # track the other remote branches
+        return bool(git.Repo(repo_name).git.ls_remote('--heads', 'origin', branch))
+
+    def create_branch(self, repo_name, branch):
+        git.Repo(repo_name).git.checkout(b=branch)
+
+    def commit_all(self, repo_name, message):
+        repo = git.Repo(repo_name)
+        repo.git.add(A=True)
+        repo.git.commit(m=message)
+        return repo.head.commit.hexsha
+
+    def commit_files(self, repo_name, source_branch, target_branch, changes, message):
+        repo = git.Repo(repo_name)
+        parent = repo.commit(source_branch)
+        tree = git.Tree(repo, write_tree(repo, parent.tree.binsha, changes))
+        commit = git.Commit.create_from_tree(repo, tree, message, parent_commits=[parent], head=False)
+        # force: a resumed run replaces the commit the interrupted one left there
+        repo.create_head(target_branch, commit, force=True)
+        return commit.hexsha
+
+    def push(self, repo_name, branch):
+        # an empty lease only lets the push through while the branch is still
+        # missing on the remote, which keeps skipping the pre-push check safe
+        git.Repo(repo_name).git.push('origin', f'refs/heads/{branch}', force_with_lease=f'refs/heads/{branch}:')
+
+    def read_blobs(self, repo_name, ref, matches):
+        repo = git.Repo(repo_name)
+        for line in repo.git.ls_tree('-r', '-z', ref).split('\0'):
+            if not line:
+                continue
+            meta, path = line.split('\t', 1)
+            _, object_type, sha = meta.split()
+            if object_type == 'blob' and matches(path):
+                # get_object_data goes through one long-lived `git cat-file --batch`
+                yield path, repo.git.get_object_data(sha)[3]
+
+
+class Pygit2Backend:
+    def __init__(self):
+        try:
+            import pygit2
+        except ImportError:
+            print("git_backend is set to pygit2 but pygit2 is not installed.")
+            exit(1)
+        self.pygit2 = pygit2
+        self._repos = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _errors(self):
+        try:
+            yield
+        except self.pygit2.GitError as e:
+            raise GitBackendError(str(e)) from e
+
+    def _open(self, repo_name):
+        path = os.path.abspath(repo_name)
+        with self._lock:
+            if path not in self._repos:
+                self._repos[path] = self.pygit2.Repository(path)
+            return self._repos[path]
+
+    def _callbacks(self, url):
+        # the PAT travels in the URL's userinfo, the same as for the git CLI
+        pygit2 = self.pygit2
+        parts = urlsplit(url)
+
+        class Callbacks(pygit2.RemoteCallbacks):
+            def __init__(self):
+                credentials = None
+                if parts.username:
+                    credentials = pygit2.UserPass(unquote(parts.username), unquote(parts.password or ""))
+                super().__init__(credentials=credentials)
+                self.rejected = None
+
+            def push_negotiation(self, updates):
+                # same guarantee as the empty --force-with-lease of the CLI backend
+                for update in updates:
+                    if any(update.src.raw):  # a non-zero old id: the branch is already there
+                        raise GitBackendError(f"{update.dst_refname} already exists on the remote")
+
+            def push_update_reference(self, refname, message):
+                if message:
+                    self.rejected = f"{refname}: {message}"
+
+        return Callbacks()
+
+    def clone(self, clone_url, repo_name, source_branch, clone_options):
+        strategy = clone_options.get("strategy", "full")
+        if strategy not in ("full", "shallow", "bare"):
+            raise ValueError(f"Clone strategy {strategy} is not supported by the pygit2 backend")
+        with self._errors():
+            repo = self.pygit2.clone_repository(clone_url, repo_name, bare=strategy == "bare",
+                                                checkout_branch=source_branch,
+                                                depth=0 if strategy == "full" else 1,
+                                                callbacks=self._callbacks(clone_url))
+        with self._lock:
+            self._repos[os.path.abspath(repo_name)] = repo
+        return repo_name
+
+    def remote_has_branch(self, repo_name, branch):
+        remote = self._open(repo_name).remotes['origin']
+        with self._errors():
+            heads = remote.list_heads(callbacks=self._callbacks(remote.url))
+        return any(head.name == f'refs/heads/{branch}' for head in heads)
+
+    def create_branch(self, repo_name, branch):
+        repo = self._open(repo_name)
+        with self._errors():
+            repo.branches.local.create(branch, repo.head.peel(self.pygit2.Commit))
+            repo.set_head(f'refs/heads/{branch}')
+
+    def commit_all(self, repo_name, message):
+        repo = self._open(repo_name)
+        with self._errors():
+            repo.index.add_all()
+            repo.index.write()
+            signature = repo.default_signature
+            commit = repo.create_commit('HEAD', signature, signature, message, repo.index.write_tree(),
+                                        [repo.head.target])
+        return str(commit)
+
+    def _write_tree(self, repo, tree, changes):
+        builder = repo.TreeBuilder(tree) if tree is not None else repo.TreeBuilder()
+        for name, change in changes.items():
+            existing = tree[name] if tree is not None and name in tree else None
+            if isinstance(change, dict):
+                subtree = existing if isinstance(existing, self.pygit2.Tree) else None
+                builder.insert(name, self._write_tree(repo, subtree, change), self.pygit2.GIT_FILEMODE_TREE)
+            else:
+                mode = existing.filemode if existing is not None else self.pygit2.GIT_FILEMODE_BLOB
+                builder.insert(name, repo.create_blob(change), mode)
+        return builder.write()
+
+    def commit_files(self, repo_name, source_branch, target_branch, changes, message):
+        repo = self._open(repo_name)
+        with self._errors():
+            parent = repo.revparse_single(source_branch).peel(self.pygit2.Commit)
+            tree = self._write_tree(repo, parent.tree, changes)
+            signature = repo.default_signature
+            commit = repo.create_commit(None, signature, signature, message, tree, [parent.id])
+            repo.references.create(f'refs/heads/{target_branch}', commit, force=True)
+        return str(commit)
+
+    def push(self, repo_name, branch):
+        remote = self._open(repo_name).remotes['origin']
+        callbacks = self._callbacks(remote.url)
+        with self._errors():
+            remote.push([f'refs/heads/{branch}:refs/heads/{branch}'], callbacks=callbacks)
+        if callbacks.rejected:
+            raise GitBackendError(f"push rejected, {callbacks.rejected}")
+
+    def _walk_blobs(self, tree, prefix, matches):
+        # same order as `git ls-tree -r`
+        for entry in tree:
+            path = f"{prefix}{entry.name}"
+            if isinstance(entry, self.pygit2.Tree):
+                yield from self._walk_blobs(entry, f"{path}/", matches)
+            elif isinstance(entry, self.pygit2.Blob) and matches(path):
+                yield path, entry.data
+
+    def read_blobs(self, repo_name, ref, matches):
+        repo = self._open(repo_name)
+        with self._errors():
+            tree = repo.revparse_single(ref).peel(self.pygit2.Tree)
+        yield from self._walk_blobs(tree, "", matches)
+
+
+GIT_BACKENDS = {
+    "gitpython": GitPythonBackend,
+    "pygit2": Pygit2Backend,
+}
+
+
+def make_git_backend(name):
+    if name not in GIT_BACKENDS:
+        print(f"Unknown git_backend {name}, expected one of {', '.join(GIT_BACKENDS)}.")
+        exit(1)
+    return GIT_BACKENDS[name]()
+
+
+# Which files are manifests: include/exclude globs matched against the
+# repo-relative path (fnmatch, so * also matches /), from the 'discovery'
+# block of projects.yaml or of the repo entry.
+MANIFEST_GLOBS = ["*.yaml", "*.yml"]
+
+
+def manifest_matcher(discovery=None):
+    discovery = discovery or {}
+    include = re.compile("|".join(fnmatch.translate(glob) for glob in discovery.get('include') or MANIFEST_GLOBS))
+    exclude_globs = discovery.get('exclude') or []
+    exclude = re.compile("|".join(fnmatch.translate(glob) for glob in exclude_globs)) if exclude_globs else None
+
+    def matches(path):
+        return include.match(path) is not None and (exclude is None or exclude.match(path) is None)
+    return matches
+
+
+def discover_manifests(repo_name, discovery=None):
+    # Candidates come from the index (plus untracked files .gitignore does not
+    # exclude) instead of walking the tree: no descent into .git or ignored
+    # build output and no stat per file. The order is fixed for a given tree,
+    # and paths are yielded while ls-files is still listing.
+    matches = manifest_matcher(discovery)
+    process = subprocess.Popen(["git", "ls-files", "-z", "-t", "--cached", "--others", "--exclude-standard"],
+                               cwd=repo_name, stdout=subprocess.PIPE)
+    try:
+        pending = b""
+        for block in iter(lambda: process.stdout.read(64 * 1024), b""):
+            *entries, pending = (pending + block).split(b"\0")
+            for entry in entries:
+                # "S " marks paths a sparse checkout left out of the working tree
+                tag, path = entry[:1], os.fsdecode(entry[2:])
+                if tag != b"S" and matches(path):
+                    yield os.path.join(repo_name, path)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()  # the caller stopped early
+        returncode = process.wait()
+    if returncode != 0:
+        raise GitBackendError(f"git ls-files failed in {repo_name} with exit code {returncode}")
+
+
+def git_blob_sha(data):
+    # same id git gives the blob, without asking git for it
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def transform_cache_settings(transform_cache, switches, api_migration_pathway, writer, pod_specs=()):
+    transform_cache = dict(transform_cache)
+    transform_cache['path'] = os.path.abspath(os.path.expanduser(transform_cache.get('path', 'transform_cache')))
+    # Any change to the rules or the tool invalidates every entry at once
+    config = json.dumps([TOOL_VERSION, switches, api_migration_pathway, writer, pod_specs], sort_keys=True,
+                        default=str)
+    transform_cache['config_hash'] = hashlib.sha256(config.encode()).hexdigest()
+    return transform_cache
+
+
+def transform_cache_entry(transform_cache, blob_sha):
+    key = hashlib.sha256(f"{blob_sha}:{transform_cache['config_hash']}".encode()).hexdigest()
+    return os.path.join(transform_cache['path'], key[:2], key)
+
+
+# An entry is b"N" (the rules leave the file alone) or b"M", then the rule
+# hits as a JSON line, then for b"M" the rewritten file.
+
+def cache_header(modified, hits):
+    return (b"M" if modified else b"N") + json.dumps(hits, sort_keys=True).encode() + b"\n"
+
+
+def read_cache_header(f):
+    modified = f.read(1) == b"M"
+    return modified, json.loads(f.readline())
+
+
+def read_transform_cache(entry):
+    # (modified, rule hits, rewritten bytes), or None on a miss
+    try:
+        with open(entry, 'rb') as f:
+            modified, hits = read_cache_header(f)
+            output = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(entry)  # LRU eviction goes by mtime
+    return modified, hits, output
+
+
+def write_transform_cache(entry, cached, source=None):
+    # cached is the whole entry, or only its marker when the rewritten bytes
+    # are streamed from the file at `source`
+    Path(entry).parent.mkdir(parents=True, exist_ok=True)
+    write_atomically(entry, cached, source)
+
+
+def temp_path_for(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def write_atomically(path, data, source=None):
+    # readers only ever see the old file or the complete new one
+    tmp = temp_path_for(path)
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        if source is not None:
+            with open(source, 'rb') as source_file:
+                shutil.copyfileobj(source_file, f)
+    if Path(path).exists():
+        shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+
+
+def evict_transform_cache(transform_cache):
+    cache_dir = transform_cache['path']
+    if not Path(cache_dir).exists():
+        return
+    max_size_mb = transform_cache.get('max_size_mb')
+    if max_size_mb is None:
+        return
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for file in files:
+            entry = os.path.join(root, file)
+            stat = os.stat(entry)
+            entries.append((stat.st_mtime, stat.st_size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= int(max_size_mb) * 1024 * 1024:
+            break
+        os.remove(entry)
+        total -= size
+
+
+DOCUMENT_START = re.compile(r"^---(?:[ \t\r\n]|$)")
+
+
+def iter_document_chunks(f):
+    # A "---" at column 0 always starts a new document (the YAML spec does not
+    # allow it inside content), so documents can be cut apart line by line
+    # without parsing. Each chunk keeps its own separator line.
+    chunk = []
+    for line in f:
+        if chunk and DOCUMENT_START.match(line):
+            yield "".join(chunk)
+            chunk = []
+        chunk.append(line)
+    if chunk:
+        yield "".join(chunk)
+
+
+# Two-tier parsing. ruamel's round-trip loader keeps comments and layout, so
+# it is what rewrites a file, but it is also many times slower than PyYAML
+# on libyaml. Every candidate file is first loaded as plain data with the C
+# loader and the rules are run on that for their effect only; a file whose
+# data comes out unchanged is done without ever reaching ruamel.
+
+_fast_loader = None
+
+
+def fast_loader():
+    # PyYAML resolves scalars the YAML 1.1 way, ruamel the YAML 1.2 way: to
+    # PyYAML `runAsNonRoot: yes` is already true, to ruamel it is a string
+    # that nonroot rewrites. The tiers must agree on which files change, so
+    # this loader takes the 1.2 core booleans and 0o octals instead. The pure
+    # Python loader is used when PyYAML was built without libyaml.
+    global _fast_loader
+    if _fast_loader is None:
+        base = getattr(pyyaml, "CSafeLoader", None) or pyyaml.SafeLoader
+
+        class FastLoader(base):
+            pass
+        bool_tag = "tag:yaml.org,2002:bool"
+        FastLoader.yaml_implicit_resolvers = {
+            first: [(tag, regexp) for tag, regexp in resolvers if tag != bool_tag]
+            for first, resolvers in base.yaml_implicit_resolvers.items()
+        }
+        FastLoader.add_implicit_resolver(bool_tag, re.compile(r"^(?:true|True|TRUE|false|False|FALSE)$"),
+                                         list("tTfF"))
+        FastLoader.add_implicit_resolver("tag:yaml.org,2002:int", re.compile(r"^[-+]?0o[0-7]+$"),
+                                         list("-+0"))
+        _fast_loader = FastLoader
+    return _fast_loader
+
+
+def needs_rewrite(text, rules):
+    # None when PyYAML cannot load the text (custom tags, ...): ruamel decides
+    try:
+        all_content = list(pyyaml.load_all(text, Loader=fast_loader()))
+    except pyyaml.YAMLError:
+        return None
+    before = copy.deepcopy(all_content)
+    apply_rules(all_content, dict(rules, options=dict(rules["options"], quiet=True)))
+    return all_content != before
+
+
+def transform_document(chunk, rules, parser, writer, timings, hits, analysis=False):
+    start = time.perf_counter()
+    if analysis:
+        rewrite = needs_rewrite(chunk, rules)
+        analyzed = time.perf_counter()
+        timings["analysis"] = timings.get("analysis", 0.0) + analyzed - start
+        if rewrite is False:
+            return chunk
+        start = analyzed
+    content = parser.load(chunk)
+    parsed = time.perf_counter()
+    timings["parse"] += parsed - start
+    # edits are recorded for either writer: a file only changes when a rule
+    # changed a value, not when it set one that was already there
+    edits = []
+    if content is not None:
+        apply_rules([content], rules, edits, hits)
+    start = time.perf_counter()
+    timings["rules"] += start - parsed
+    if not edits:
+        return chunk
+    patched = render_edits(chunk, edits) if writer == "patch" else None
+    if patched is None:
+        buffer = io.StringIO()
+        if DOCUMENT_START.match(chunk):
+            buffer.write('---\n')
+        parser.dump(content, buffer)
+        patched = buffer.getvalue()
+    timings["dump"] += time.perf_counter() - start
+    return patched
+
+
+def file_blob_sha(filepath):
+    sha = hashlib.sha1(b"blob %d\0" % os.path.getsize(filepath))
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def transform_file_streaming(filepath, rules, parser, transform_cache, writer, analysis=False):
+    # One document in memory at a time: the output goes to a temp file next
+    # to the original, which is renamed over it only if some document changed.
+    entry = None
+    if transform_cache is not None:
+        entry = transform_cache_entry(transform_cache, file_blob_sha(filepath))
+        if Path(entry).exists():
+            os.utime(entry)
+            with open(entry, 'rb') as cached:
+                modified, hits = read_cache_header(cached)
+                if modified:
+                    tmp = temp_path_for(filepath)
+                    with open(tmp, 'wb') as f:
+                        shutil.copyfileobj(cached, f)
+                    shutil.copymode(filepath, tmp)
+                    os.replace(tmp, filepath)
+            return {"path": filepath, "modified": modified, "cache": "hit", "timings": {}, "rules": hits}
+
+    timings = {"parse": 0.0, "rules": 0.0, "dump": 0.0}
+    hits = {}
+    tmp = temp_path_for(filepath)
+    modified = False
+    try:
+        with open(filepath, 'r', encoding='utf-8', newline='') as source, \
+                open(tmp, 'w', encoding='utf-8', newline='') as target:
+            for chunk in iter_document_chunks(source):
+                output = transform_document(chunk, rules, parser, writer, timings, hits, analysis)
+                modified = modified or output != chunk
+                target.write(output)
+        if modified:
+            if entry is not None:
+                write_transform_cache(entry, cache_header(True, hits), tmp)
+            shutil.copymode(filepath, tmp)
+            os.replace(tmp, filepath)
+        elif entry is not None:
+            write_transform_cache(entry, cache_header(False, hits))
+    finally:
+        if Path(tmp).exists():
+            os.remove(tmp)
+    return {"path": filepath, "modified": modified, "cache": "miss" if entry is not None else None,
+            "timings": timings, "rules": hits}
+
+
+def transform_file(filepath, rules, parser=None, transform_cache=None, writer="patch", data=None, write=True,
+                   stream_threshold=None, analysis=False):
+    # With write=False (plumbing commits) nothing touches the working tree and
+    # the new bytes come back in result["output"]; data can then come straight
+    # from a blob instead of the file on disk. Files on disk of at least
+    # stream_threshold bytes are handled a document at a time instead. With
+    # analysis, only files the fast tier says will change are loaded by ruamel.
+    parser = parser or thread_yaml()
+    if data is None and write and stream_threshold is not None and os.path.getsize(filepath) >= stream_threshold:
+        return transform_file_streaming(filepath, rules, parser, transform_cache, writer, analysis)
+    if data is None:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+
+    entry = None
+    if transform_cache is not None:
+        entry = transform_cache_entry(transform_cache, git_blob_sha(data))
+        cached = read_transform_cache(entry)
+        if cached is not None:
+            modified, hits, output = cached
+            result = {"path": filepath, "modified": modified, "cache": "hit", "timings": {}, "rules": hits}
+            if modified:
+                if write:
+                    write_atomically(filepath, output)
+                else:
+                    result["output"] = output
+            return result
+
+    start = time.perf_counter()
+    text = data.decode('utf-8')
+    if analysis and needs_rewrite(text, rules) is False:
+        if entry is not None:
+            write_transform_cache(entry, cache_header(False, {}))
+        return {"path": filepath, "modified": False, "cache": "miss" if entry is not None else None,
+                "timings": {"analysis": time.perf_counter() - start}, "rules": {}, "ruamel": False}
+    analyzed = time.perf_counter()
+    all_content = []
+    all_documents = parser.load_all(text)
+    for doc in all_documents:
+        all_content.append(doc)
+    parsed = time.perf_counter()
+
+    # edits are recorded for either writer: a file only changes when a rule
+    # changed a value, not when it set one that was already there
+    edits = []
+    hits = {}
+    apply_rules(all_content, rules, edits, hits)
+    modified = bool(edits)
+    applied = time.perf_counter()
+    timings = {"parse": parsed - analyzed, "rules": applied - parsed, "dump": 0.0}
+    if analysis:
+        timings["analysis"] = analyzed - start
+    output = None
+    if modified:
+        patched = render_edits(text, edits) if writer == "patch" else None
+        if patched is None:
+            buffer = io.StringIO()
+            for idx, content in enumerate(all_content):
+                if idx != 0:
+                    buffer.write('---\n')  # Add a separator if this isn't the first document
+                parser.dump(content, buffer)
+            patched = buffer.getvalue()
+        output = patched.encode('utf-8')
+        timings["dump"] = time.perf_counter() - applied
+        modified = output != data
+        if modified and write:
+            write_atomically(filepath, output)
+    if entry is not None:
+        write_transform_cache(entry, cache_header(modified, hits) + (output if modified else b""))
+    result = {"path": filepath, "modified": modified, "cache": "miss" if entry is not None else None,
+              "timings": timings, "rules": hits}
+    if modified and not write:
+        result["output"] = output
+    return result
+
+
+def make_transform_pool(transform):
+    workers = int(transform.get("file_workers", 1))
+    if workers <= 1:
+        return None
+    # spawn rather than fork: the pipeline stages are threads, and forking a
+    # threaded process can copy a held lock into the child
+    return concurrent_futures.ProcessPoolExecutor(max_workers=workers,
+                                                  mp_context=multiprocessing.get_context("spawn"),
+                                                  initializer=configure_logging,
+                                                  initargs=(log.getEffectiveLevel(),))
+
+
+run_stats = {"files_seen": 0, "files_prefiltered": 0}
+_run_stats_lock = threading.Lock()
+
+
+def count(name, amount=1):
+    with _run_stats_lock:
+        run_stats[name] = run_stats.get(name, 0) + amount
+
+
+# Where the time goes: seconds per phase, the slowest files by parse +
+# rules + dump time, and how often each switch changed something.
+# write_profile() saves it at the end of the run; the per-repo numbers go
+# to the run report as each repo finishes instead of piling up here.
+run_profile = {"phases": {}, "rule_hits": {}, "slowest_files": [], "slowest_limit": 20}
+
+
+@contextmanager
+def timed(phase, timings=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _run_stats_lock:
+            run_profile["phases"][phase] = run_profile["phases"].get(phase, 0.0) + elapsed
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + elapsed
+
+
+def profile_files(repo_name, results):
+    with _run_stats_lock:
+        rule_hits = run_profile["rule_hits"]
+        slowest = run_profile["slowest_files"]  # min-heap of the slowest_limit slowest files
+        for result in results:
+            for switch, hits in result["rules"].items():
+                rule_hits[switch] = rule_hits.get(switch, 0) + hits
+            if not result["timings"]:
+                continue  # transform cache hit
+            entry = (sum(result["timings"].values()), f"{repo_name}/{result['path']}", result["timings"])
+            if len(slowest) < run_profile["slowest_limit"]:
+                heapq.heappush(slowest, entry)
+            elif entry[0] > slowest[0][0]:
+                heapq.heapreplace(slowest, entry)
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def profile_settings(profile):
+    profile = dict(profile)
+    for key in ('path', 'prometheus_textfile'):
+        if profile.get(key):
+            profile[key] = os.path.abspath(os.path.expanduser(profile[key]))
+    return profile
+
+
+def build_profile(wall_seconds):
+    with _run_stats_lock:
+        slowest = sorted(run_profile["slowest_files"], reverse=True)
+        return {
+            "tool_version": TOOL_VERSION,
+            "wall_seconds": wall_seconds,
+            "phases": dict(run_profile["phases"]),
+            "slowest_files": [dict(path=path, seconds=seconds, **timings) for seconds, path, timings in slowest],
+            "rule_hits": dict(run_profile["rule_hits"]),
+            "files": dict(run_stats),
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+
+def prometheus_metrics(profile):
+    lines = [
+        "# HELP k8zilla_run_seconds Wall time of the last k8zilla run.",
+        "# TYPE k8zilla_run_seconds gauge",
+        f"k8zilla_run_seconds {profile['wall_seconds']:.6f}",
+        "# HELP k8zilla_phase_seconds Time spent per phase in the last run, summed over repos.",
+        "# TYPE k8zilla_phase_seconds gauge",
+    ]
+    lines += [f'k8zilla_phase_seconds{{phase="{phase}"}} {seconds:.6f}'
+              for phase, seconds in sorted(profile["phases"].items())]
+    lines += [
+        "# HELP k8zilla_rule_hits Changes made per switch in the last run.",
+        "# TYPE k8zilla_rule_hits gauge",
+    ]
+    lines += [f'k8zilla_rule_hits{{switch="{switch}"}} {hits}' for switch, hits in sorted(profile["rule_hits"].items())]
+    lines += [
+        "# HELP k8zilla_run_stats Manifest files seen, prefiltered and served from the transform cache.",
+        "# TYPE k8zilla_run_stats gauge",
+    ]
+    lines += [f'k8zilla_run_stats{{stat="{stat}"}} {value}' for stat, value in sorted(profile["files"].items())]
+    if profile["peak_rss_bytes"] is not None:
+        lines += [
+            "# HELP k8zilla_peak_rss_bytes Peak resident set size of k8zilla and of its child processes.",
+            "# TYPE k8zilla_peak_rss_bytes gauge",
+        ]
+        lines += [f'k8zilla_peak_rss_bytes{{process="{process}"}} {value}'
+                  for process, value in sorted(profile["peak_rss_bytes"].items())]
+    lines += [
+        "# HELP k8zilla_last_run_timestamp_seconds When the last k8zilla run finished.",
+        "# TYPE k8zilla_last_run_timestamp_seconds gauge",
+        f"k8zilla_last_run_timestamp_seconds {time.time():.0f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_profile(profile_config, wall_seconds):
+    profile = build_profile(wall_seconds)
+    if profile_config.get('path'):
+        write_atomically(profile_config['path'], json.dumps(profile, indent=2).encode('utf-8'))
+    if profile_config.get('prometheus_textfile'):
+        # the node_exporter textfile collector must never see a partial file
+        write_atomically(profile_config['prometheus_textfile'], prometheus_metrics(profile).encode('utf-8'))
+    return profile
+
+
+def configure_logging(level):
+    # only k8zilla's own logger, so log_level: debug does not also turn on
+    # GitPython's command tracing
+    if isinstance(level, str):
+        level = level.upper()
     try:
-        if f'origin/{target_branch}' in repo.git.branch('-r'):
-            print(f"{target_branch} branch already exists in remote for {repo_name}, skipping...")
+        log.setLevel(level)
+    except ValueError:
+        print(f"Unknown log_level {level}, expected debug, info, warning or error.")
+        exit(1)
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.propagate = False
+
+
+def build_prefilter(rules):
+    # Raw byte patterns for the only documents the enabled rules can change:
+    # their kinds, plus whatever pattern an any-kind rule (upgrade_apis: the
+    # pathway's source apiVersions) supplies. Quotes and flow/JSON style are
+    # allowed for, so this only ever lets through a superset of real matches.
+    alternatives = []
+    if rules["by_kind"]:
+        kinds = b"|".join(re.escape(kind.encode()) for kind in sorted(rules["by_kind"]))
+        alternatives.append(rb"\bkind[\"']?\s*:\s*[\"']?(?:" + kinds + rb")\b")
+    container_rules, document_rules, _ = rules["default"]
+    for rule in container_rules + document_rules:
+        pattern = rule.prefilter(rules["options"]) if rule.prefilter else None
+        if pattern is None:
+            return None  # an any-kind rule that cannot be prefiltered: parse everything
+        alternatives.append(pattern)
+    if not alternatives:
+        return re.compile(rb"(?!)")  # nothing is switched on, nothing can match
+    return re.compile(b"|".join(alternatives))
+
+
+def may_need_changes(filepath, prefilter):
+    with open(filepath, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return prefilter.search(data) is not None
+        except ValueError:  # empty files cannot be mapped, and hold no documents
             return False
-        repo.git.checkout(b=target_branch)
-    except git.exc.GitCommandError as e:
+
+
+def commits_with_plumbing(repo_name, settings):
+    # bare clones have no working tree to stage from
+    return settings['commit'].get('mode', 'worktree') == 'plumbing' or not Path(repo_name, '.git').exists()
+
+
+def stream_threshold_for(transform):
+    streaming = transform.get('streaming', 'auto')
+    if streaming == 'on':
+        return 0
+    if streaming == 'auto':
+        return int(float(transform.get('stream_threshold_mb', 5)) * 1024 * 1024)
+    return None
+
+
+def counted(items, name):
+    for item in items:
+        count(name)
+        yield item
+
+
+def prefiltered(filepaths, prefilter):
+    for filepath in filepaths:
+        if may_need_changes(filepath, prefilter):
+            yield filepath
+        else:
+            count("files_prefiltered")
+
+
+def transform_repo(repo_name, settings, parser=None, pool=None, discovery=None):
+    # Returns the results of the files that changed, with repo-relative paths
+    rules = settings['rules']
+    prefilter = settings['prefilter']
+    transform_cache = settings['transform_cache']
+    writer = settings['transform'].get('writer', 'patch')
+    plumbing = commits_with_plumbing(repo_name, settings)
+    stream_threshold = stream_threshold_for(settings['transform'])
+    analysis = settings['analysis']
+
+    discovery = discovery if discovery is not None else settings['discovery']
+    worktree = Path(repo_name, '.git').exists()
+    if worktree:
+        # kept lazy so the first files are parsed while discovery goes on
+        filepaths = counted(discover_manifests(repo_name, discovery), "files_seen")
+        if prefilter is not None:
+            filepaths = prefiltered(filepaths, prefilter)
+        blobs = repeat(None)
+    else:
+        manifests = list(settings['git_backend'].read_blobs(repo_name, settings['source_branch'],
+                                                            manifest_matcher(discovery)))
+        count("files_seen", len(manifests))
+        if prefilter is not None:
+            candidates = [(path, data) for path, data in manifests if prefilter.search(data) is not None]
+            count("files_prefiltered", len(manifests) - len(candidates))
+            manifests = candidates
+        filepaths = [path for path, _ in manifests]
+        blobs = [data for _, data in manifests]
+
+    if pool is None:
+        parser = parser or thread_yaml()
+        results = [transform_file(filepath, rules, parser, transform_cache, writer, data, not plumbing,
+                                  stream_threshold, analysis)
+                   for filepath, data in zip(filepaths, blobs)]
+    else:
+        # every worker process builds its own YAML instance via thread_yaml();
+        # map() yields in submission order, so the fold below is deterministic
+        results = list(pool.map(transform_file, filepaths, repeat(rules), repeat(None), repeat(transform_cache),
+                                repeat(writer), blobs, repeat(not plumbing), repeat(stream_threshold),
+                                repeat(analysis), chunksize=4))
+    for result in results:
+        if result["cache"] is not None:
+            count(f"transform_cache_{result['cache']}")
+        if result.get("ruamel") is False:
+            count("files_ruamel_skipped")
+        if worktree:
+            result["path"] = Path(result["path"]).relative_to(repo_name).as_posix()
+    profile_files(repo_name, results)
+    return [result for result in results if result["modified"]]
+
+
+def push_outcome(repo_name, settings, changes, check_remote=True, on_commit=None, url=None):
+    # (bucket, commit sha, skip reason)
+    if commits_with_plumbing(repo_name, settings):
+        commit, reason = commit_with_plumbing(repo_name, settings['source_branch'], settings['target_branch'],
+                                              {change["path"]: change["output"] for change in changes},
+                                              check_remote, settings['git_backend'], on_commit, url)
+    else:
+        commit, reason = create_branch_and_commit(repo_name, settings['target_branch'], check_remote,
+                                                  settings['git_backend'], on_commit, url)
+    return ("modified" if reason is None else "skipped"), commit, reason
+
+
+def list_remote_branches(url, PAT, branches):
+    output = remote_scheduler.call(url, "ls-remote", git.Git().ls_remote, '--heads', clone_url_for(url, PAT),
+                                   *[f"refs/heads/{branch}" for branch in branches])
+    refs = {}
+    for line in output.splitlines():
+        sha, ref = line.split('\t', 1)
+        refs[ref] = sha
+    return refs
+
+
+def preflight(repos, PAT, settings):
+    # One ls-remote per repo, all in parallel and before any clone, for just
+    # the source and target branches
+    branches = [settings['source_branch'], settings['target_branch']]
+    workers = int(settings['preflight'].get('workers', 8))
+    with concurrent_futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {repo['url']: executor.submit(list_remote_branches, repo['url'], PAT, branches) for repo in repos}
+    remote_refs = {}
+    for url, future in futures.items():
+        try:
+            remote_refs[url] = future.result()
+        except git.exc.GitCommandError as e:
+            print(f"An error occurred: {str(e)}")
+            remote_refs[url] = None
+    return remote_refs
+
+
+def preflight_skip(url, settings, remote_refs):
+    if remote_refs is None:
+        return None
+    repo_name = repo_name_from_url(url)
+    refs = remote_refs.get(url)
+    if refs is None:
+        return f"Could not list the branches of {repo_name}"
+    if f"refs/heads/{settings['target_branch']}" in refs:
+        return f"{settings['target_branch']} branch already exists in remote for {repo_name}"
+    if f"refs/heads/{settings['source_branch']}" not in refs:
+        return f"{settings['source_branch']} branch does not exist in remote for {repo_name}"
+    return None
+
+
+# Run report: one JSON line per repo, written and flushed as soon as the
+# repo is done, so a crash keeps everything finished so far and memory does
+# not grow with the fleet. The end-of-run summary is read back from it.
+
+def open_run_report(path, mode="w"):
+    return {"file": open(path, mode), "lock": threading.Lock(), "path": path}
+
+
+def repo_record(index, url, outcome, reason=None, commit=None, changes=(), timings=None):
+    files = []
+    rule_changes = {}
+    for change in changes:
+        files.append({"path": change["path"], "rules": change.get("rules", {}),
+                      "timings": change.get("timings", {}), "cache": change.get("cache")})
+        for switch, hits in change.get("rules", {}).items():
+            rule_changes[switch] = rule_changes.get(switch, 0) + hits
+    return {
+        "index": index,
+        "repo": repo_name_from_url(url),
+        "url": url,
+        "outcome": outcome,
+        "reason": reason,
+        "commit": commit,
+        "files_changed": len(files),
+        "rule_changes": rule_changes,
+        "timings": timings or {},
+        "retries": remote_scheduler.take_retries(url),
+        "files": files,
+    }
+
+
+def record_outcome(run_report, record, sync=False):
+    line = json.dumps(record) + "\n"
+    with run_report["lock"]:
+        run_report["file"].write(line)
+        run_report["file"].flush()
+        if sync:
+            os.fsync(run_report["file"].fileno())
+
+
+def read_run_report(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# Run journal: one fsynced JSON line per repo and phase (cloned,
+# transformed, committed, pushed, finished), kept next to projects.yaml so
+# it survives the temp_repos wipe. With run --resume, finished repos are skipped
+# and the others pick up after their last journaled phase; the journal
+# shares record_outcome's lock, so pipeline workers can append to it at the
+# same time.
+
+JOURNAL_PHASES = ["cloned", "transformed", "committed", "pushed", "finished"]
+
+
+def open_journal(path, settings, resume):
+    branches = {"source_branch": settings['source_branch'], "target_branch": settings['target_branch']}
+    state = read_journal(path, branches) if resume else {}
+    journal = open_run_report(path, "a" if resume else "w")
+    if not resume:
+        record_outcome(journal, dict(branches, phase="started"), sync=True)
+    return journal, state
+
+
+def read_journal(path, branches):
+    state = {}
+    if not Path(path).exists():
+        return state
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by the interruption
+            if entry["phase"] == "started":
+                if any(entry[key] != value for key, value in branches.items()):
+                    print(f"{path} is from a run with other branches, start over without --resume.")
+                    exit(1)
+                continue
+            previous = state.get(entry["url"], {})
+            state[entry["url"]] = dict(previous, **entry)
+    return state
+
+
+def journal_phase(journal, url, phase, **details):
+    if journal is not None:
+        record_outcome(journal, dict(details, url=url, phase=phase), sync=True)
+
+
+def journaled(state, url, phase):
+    # whether url already got past phase in an earlier run
+    reached = state.get(url, {}).get("phase")
+    return reached is not None and JOURNAL_PHASES.index(reached) >= JOURNAL_PHASES.index(phase)
+
+
+def journal_changes(changes):
+    return [{key: value for key, value in change.items() if key != "output"} for change in changes]
+
+
+def reset_working_copy(repo_name, source_branch):
+    repo = git.Repo(repo_name)
+    repo.git.reset('--hard', source_branch)
+    repo.git.clean('-fd')
+
+
+def restore_source_branch(repo_name, source_branch, target_branch):
+    # Only HEAD moves: the working tree and index keep the transformed files,
+    # even when an interrupted commit already landed on target_branch
+    repo = git.Repo(repo_name)
+    repo.git.symbolic_ref('HEAD', f'refs/heads/{source_branch}')
+    if target_branch in repo.heads:
+        repo.git.branch('-D', target_branch)
+
+
+def clone_phase(repo, PAT, settings, journal, state, timings):
+    url = repo['url']
+    repo_name = repo_name_from_url(url)
+    if journaled(state, url, "cloned") and Path(repo_name).exists():
+        if not journaled(state, url, "transformed") and Path(repo_name, '.git').exists():
+            # the interrupted transform may have rewritten some files already,
+            # which would then come out unchanged and never be committed
+            reset_working_copy(repo_name, settings['source_branch'])
+        return repo_name
+    # anything journaled past the clone belongs to the working copy that is gone
+    state.pop(url, None)
+    with timed("clone", timings):
+        clone_repo(url, PAT, settings['source_branch'], clone_options_for(repo, settings),
+                   settings['mirror_cache'], settings['git_backend'])
+    journal_phase(journal, url, "cloned")
+    return repo_name
+
+
+def transform_phase(repo, repo_name, settings, journal, state, timings, parser=None, pool=None):
+    # A worktree that was already rewritten would come out unchanged, so the
+    # journaled changes are reused; plumbing keeps its new blobs in memory
+    # only, so those repos are transformed again from the source branch.
+    url = repo['url']
+    if journaled(state, url, "transformed") and not commits_with_plumbing(repo_name, settings):
+        return state[url]["changes"]
+    with timed("transform", timings):
+        changes = transform_repo(repo_name, settings, parser, pool, discovery_for(repo, settings))
+    journal_phase(journal, url, "transformed", changes=journal_changes(changes))
+    return changes
+
+
+def push_phase(url, repo_name, settings, changes, journal, state, check_remote, timings):
+    if journaled(state, url, "pushed"):
+        return "modified", state[url]["commit"], None
+    with timed("push", timings):
+        if journaled(state, url, "committed") and not commits_with_plumbing(repo_name, settings):
+            commit, reason = push_commit(repo_name, settings, state[url]["commit"], url)
+        else:
+            if journaled(state, url, "transformed") and not commits_with_plumbing(repo_name, settings):
+                # the interrupted run may have got as far as `checkout -b`
+                restore_source_branch(repo_name, settings['source_branch'], settings['target_branch'])
+            outcome, commit, reason = push_outcome(repo_name, settings, changes, check_remote,
+                                                   lambda sha: journal_phase(journal, url, "committed", commit=sha),
+                                                   url)
+    if reason is None:
+        journal_phase(journal, url, "pushed", commit=commit)
+    return ("modified" if reason is None else "skipped"), commit, reason
+
+
+def push_commit(repo_name, settings, commit, url=None):
+    try:
+        remote_scheduler.call(url, "push", settings['git_backend'].push, repo_name, settings['target_branch'])
+    except git_errors() as e:
         print(f"An error occurred: {str(e)}, skipping...")
-        return False
-    repo.git.add(A=True)
-    repo.git.commit(m='Harden Kubernetes configurations')
-    repo.git.push('origin', target_branch)
-    return True
+        return None, f"An error occurred: {str(e)}"
+    return commit, None
 
 
-def main():
-    print_k8zilla()
-    display_message_and_wait()
+def finish_repo(run_report, journal, record):
+    record_outcome(run_report, record)
+    journal_phase(journal, record["url"], "finished", outcome=record["outcome"])
 
-    PAT = read_env_variable()
-    project_data = read_project_file()
-    repos = project_data.get('repos', [])
-    switches = project_data.get('switches', {})
-    api_migration_pathway = project_data.get('api_migration_pathway', [])
-    source_branch = project_data.get('source_branch', 'main')
-    target_branch = project_data.get('target_branch', 'feature_k8s_hardening')
 
-    if Path("temp_repos").exists():
-        shutil.rmtree("temp_repos")
-    Path("temp_repos").mkdir()
-    os.chdir("temp_repos")
+def process_repo(index, repo, PAT, settings, run_report, pool=None, remote_refs=None, journal=None, state=None,
+                 parser=None):
+    # One repo from preflight verdict to report record, which is returned
+    state = state if state is not None else {}
+    url = repo['url']
+    reason = preflight_skip(url, settings, remote_refs)
+    if reason is not None:
+        print(f"{reason}, skipping...")
+        record = repo_record(index, url, "skipped", reason)
+        finish_repo(run_report, journal, record)
+        return record
+    print(f"Processing {url}...")
+    timings = {}
+    try:
+        repo_name = clone_phase(repo, PAT, settings, journal, state, timings)
+    except git_errors() as e:
+        print(f"An error occurred: {str(e)}, skipping...")
+        record = repo_record(index, url, "skipped", f"An error occurred: {str(e)}", timings=timings)
+        finish_repo(run_report, journal, record)
+        return record
+    changes = transform_phase(repo, repo_name, settings, journal, state, timings, parser, pool)
+
+    if changes:
+        outcome, commit, reason = push_phase(url, repo_name, settings, changes, journal, state,
+                                             remote_refs is None, timings)
+        record = repo_record(index, url, outcome, reason, commit, changes, timings)
+    else:
+        record = repo_record(index, url, "not_modified", timings=timings)
+    finish_repo(run_report, journal, record)
+    return record
+
+
+def run_sequential(repos, PAT, settings, run_report, pool=None, remote_refs=None, journal=None, state=None):
+    state = state if state is not None else {}
+    for index, repo in enumerate(repos):
+        if journaled(state, repo['url'], "finished"):
+            print(f"{repo['url']} finished in an earlier run, skipping...")
+            continue
+        process_repo(index, repo, PAT, settings, run_report, pool, remote_refs, journal, state)
+
+
+def start_stage(worker, inbox, outbox, workers):
+    def loop():
+        while True:
+            item = inbox.get()
+            if item is STOP:
+                inbox.put(STOP)  # hand the sentinel on to the sibling workers
+                return
+            try:
+                result = worker(item)
+            except Exception as e:
+                print(f"An error occurred: {str(e)}, skipping...")
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def close_stage(threads, outbox):
+    # the stage's inbox already got its STOP from the stage before it; one
+    # sentinel per queue, a second would block on a full queue_size: 1 queue
+    for thread in threads:
+        thread.join()
+    if outbox is not None:
+        outbox.put(STOP)
+
+
+def run_pipeline(repos, PAT, settings, run_report, pool=None, remote_refs=None, journal=None, state=None):
+    # Clone -> transform -> push, each stage with its own worker count and a
+    # bounded queue in between so clones run ahead of the transform stage
+    # without filling the disk with the whole fleet.
+    pipeline = settings['pipeline']
+    queue_size = int(pipeline.get("queue_size", 4))
+    state = state if state is not None else {}
+    reported = bytearray(len(repos))  # one byte per repo, set once its record is written
 
+    def report(record):
+        finish_repo(run_report, journal, record)
+        reported[record["index"]] = 1
+    to_clone = queue.Queue(maxsize=queue_size)
+    to_transform = queue.Queue(maxsize=queue_size)
+    to_push = queue.Queue(maxsize=queue_size)
+
+    def clone_stage(item):
+        index, repo = item
+        url = repo['url']
+        print(f"Processing {url}...")
+        timings = {}
+        try:
+            repo_name = clone_phase(repo, PAT, settings, journal, state, timings)
+        except git_errors() as e:
+            print(f"An error occurred: {str(e)}, skipping...")
+            report(repo_record(index, url, "skipped", f"An error occurred: {str(e)}", timings=timings))
+            return None
+        return index, repo, repo_name, timings
+
+    def transform_stage(item):
+        index, repo, repo_name, timings = item
+        url = repo['url']
+        changes = transform_phase(repo, repo_name, settings, journal, state, timings, thread_yaml(), pool)
+        if changes:
+            return index, url, repo_name, timings, changes
+        report(repo_record(index, url, "not_modified", timings=timings))
+        return None
+
+    def push_stage(item):
+        index, url, repo_name, timings, changes = item
+        outcome, commit, reason = push_phase(url, repo_name, settings, changes, journal, state,
+                                             remote_refs is None, timings)
+        report(repo_record(index, url, outcome, reason, commit, changes, timings))
+        return None
+
+    cloners = start_stage(clone_stage, to_clone, to_transform, int(pipeline.get("clone_workers", 4)))
+    transformers = start_stage(transform_stage, to_transform, to_push, int(pipeline.get("transform_workers", 2)))
+    pushers = start_stage(push_stage, to_push, None, int(pipeline.get("push_workers", 2)))
+
+    for index, repo in enumerate(repos):
+        if journaled(state, repo['url'], "finished"):
+            print(f"{repo['url']} finished in an earlier run, skipping...")
+            reported[index] = 1
+            continue
+        reason = preflight_skip(repo['url'], settings, remote_refs)
+        if reason is not None:
+            print(f"{reason}, skipping...")
+            report(repo_record(index, repo['url'], "skipped", reason))
+            continue
+        to_clone.put((index, repo))
+    to_clone.put(STOP)
+    close_stage(cloners, to_transform)
+    close_stage(transformers, to_push)
+    close_stage(pushers, None)
+
+    # a repo whose stage raised never got a record and is reported as skipped
+    for index, repo in enumerate(repos):
+        if not reported[index]:
+            report(repo_record(index, repo['url'], "skipped", "failed, see the error above"))
+
+
+def build_report(outcomes):
+    # outcomes are (index, repo, outcome) and can arrive in any order from
+    # the pipeline; the summary lists repos in projects.yaml order
     report = {
         "modified": [],
         "not_modified": [],
         "skipped": []
     }
+    for index, repo_name, outcome in outcomes:
+        report[outcome].append((index, repo_name))
+    return {bucket: [repo_name for _, repo_name in sorted(entries)] for bucket, entries in report.items()}
+
+
+def pull_request_record(record):
+    # what open_pull_request reads, without the per-file rules and timings
+    pushed = {key: record[key] for key in ("index", "repo", "url", "rule_changes", "files_changed")}
+    pushed["files"] = [{"path": change["path"]} for change in record["files"]]
+    return pushed
+
+
+def summarize_run_report(path):
+    # One pass over the report, keeping (index, repo, outcome) per repo and
+    # the pull request fields of pushed repos, so memory does not follow the
+    # per-file details. A resumed run can repeat the record of a repo that
+    # was interrupted right after it was reported; the last one wins.
+    outcomes = {}
+    pushed = {}
+    for record in read_run_report(path):
+        outcomes[record["url"]] = (record["index"], record["repo"], record["outcome"])
+        if record["outcome"] == "modified":
+            pushed[record["url"]] = pull_request_record(record)
+        else:
+            pushed.pop(record["url"], None)
+    return build_report(outcomes.values()), sorted(pushed.values(), key=lambda record: record["index"])
+
+
+# Pull requests: every repo that was pushed gets one from target_branch into
+# source_branch through the GitHub REST API at api_url (GitHub Enterprise and
+# local stand-in servers work the same). A single GitHubClient is shared by
+# all workers: it keeps a pool of keep-alive connections, lets at most
+# max_concurrency requests be in flight, makes every worker wait out
+# Retry-After and exhausted X-RateLimit-Remaining windows, and revalidates
+# the open pull request listings with their ETags. The ETags are kept in
+# etag_cache between runs, so a repeated run mostly gets 304s, which do not
+# count against the rate limit.
+
+class GitHubError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status} {message}" if status else message)
+        self.status = status
+
+
+class GitHubClient:
+    def __init__(self, api_url, token, max_concurrency=4, max_retries=3, etags=None):
+        parts = urlsplit(api_url)
+        self.host = parts.netloc
+        self.https = parts.scheme == "https"
+        self.prefix = parts.path.rstrip("/")
+        self.headers = {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {token}",
+            "User-Agent": "k8zilla",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+        self.max_retries = max_retries
+        self.etags = etags if etags is not None else {}  # path -> [etag, body]
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._connections = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._resume_at = 0.0  # no request goes out before this time
+
+    def _connection(self):
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            if self.https:
+                return http_client.HTTPSConnection(self.host, timeout=30)
+            return http_client.HTTPConnection(self.host, timeout=30)
+
+    def _wait_for_rate_limit(self):
+        with self._lock:
+            delay = self._resume_at - time.time()
+        if delay > 0:
+            log.info("GitHub rate limit, waiting %.0fs", delay)
+            time.sleep(delay)
+
+    def _hold_until(self, resume_at):
+        with self._lock:
+            self._resume_at = max(self._resume_at, resume_at)
+
+    def _rate_limit_reset(self, headers):
+        # when requests may go out again, if this response says to hold off
+        if headers.get("Retry-After"):
+            return time.time() + float(headers["Retry-After"])
+        if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset"):
+            return float(headers["X-RateLimit-Reset"])
+        return None
+
+    def _send(self, method, path, payload, headers):
+        with self._slots:
+            connection = self._connection()
+            try:
+                connection.request(method, self.prefix + path, payload, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http_client.HTTPException):
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._connections.put(connection)
+        count("github_requests")
+        return response.status, response.headers, data
+
+    def request(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else None
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit()
+            headers = dict(self.headers)
+            if payload is not None:
+                headers["Content-Type"] = "application/json"
+            cached = self.etags.get(path) if method == "GET" else None
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+            try:
+                status, response_headers, data = self._send(method, path, payload, headers)
+            except (OSError, http_client.HTTPException) as e:
+                if attempt == self.max_retries:
+                    raise GitHubError(None, f"{method} {path}: {e}")
+                time.sleep(2 ** attempt)
+                continue
+            resume_at = self._rate_limit_reset(response_headers)
+            if resume_at is not None:
+                self._hold_until(resume_at)
+            if status == 304:
+                count("github_not_modified")
+                return cached[1]
+            if status < 300:
+                result = json.loads(data) if data else None
+                if method == "GET" and response_headers.get("ETag"):
+                    self.etags[path] = [response_headers["ETag"], result]
+                return result
+            rate_limited = status == 429 or (status == 403 and resume_at is not None)
+            if attempt < self.max_retries and (rate_limited or status >= 500):
+                if not rate_limited:
+                    time.sleep(2 ** attempt)
+                continue
+            try:
+                message = json.loads(data).get("message", "")
+            except ValueError:
+                message = data.decode(errors="replace")[:200]
+            raise GitHubError(status, f"{method} {path}: {message}")
+
+
+def github_repo_for(url):
+    path = urlsplit(url).path.strip("/")
+    if path.endswith(".git"):
+        path = path[:-4]
+    owner, repo = path.split("/")[-2:]
+    return owner, repo
 
 
+def pull_request_body(record):
+    lines = ["Automated hardening of the Kubernetes manifests in this repository.", ""]
+    lines += [f"- `{switch}`: {hits} change(s)" for switch, hits in sorted(record["rule_changes"].items())]
+    lines += ["", f"{record['files_changed']} file(s) changed:"]
+    lines += [f"- `{change['path']}`" for change in record["files"]]
+    return "\n".join(lines) + "\n"
+
+
+def open_pull_request(client, record, settings):
+    # Returns ("opened" | "exists", html_url)
+    owner, repo = github_repo_for(record["url"])
+    head = f"{owner}:{settings['target_branch']}"
+    base = settings['source_branch']
+    query = urlencode({"state": "open", "head": head, "base": base})
+    existing = client.request("GET", f"/repos/{owner}/{repo}/pulls?{query}")
+    if existing:
+        return "exists", existing[0]["html_url"]
+    pull_requests = settings['pull_requests']
+    try:
+        created = client.request("POST", f"/repos/{owner}/{repo}/pulls", {
+            "title": pull_requests.get('title', COMMIT_MESSAGE),
+            "head": settings['target_branch'],
+            "base": base,
+            "body": pull_request_body(record),
+            "draft": pull_requests.get('draft', 'off') == 'on',
+        })
+    except GitHubError as e:
+        # opened by someone else since the listing was cached
+        if e.status == 422 and "already exists" in str(e):
+            return "exists", None
+        raise
+    return "opened", created["html_url"]
+
+
+def read_etag_cache(path):
+    if not path or not Path(path).exists():
+        return {}
+    try:
+        return json.loads(Path(path).read_text())
+    except ValueError:
+        return {}
+
+
+def make_github_client(PAT, pull_requests):
+    return GitHubClient(pull_requests.get('api_url', 'https://api.github.com'), PAT,
+                        int(pull_requests.get('max_concurrency', 4)), int(pull_requests.get('max_retries', 3)),
+                        read_etag_cache(pull_requests.get('etag_cache')))
+
+
+def save_etag_cache(client, pull_requests):
+    if pull_requests.get('etag_cache'):
+        Path(pull_requests['etag_cache']).parent.mkdir(parents=True, exist_ok=True)
+        write_atomically(pull_requests['etag_cache'], json.dumps(client.etags).encode())
+
+
+def open_pull_requests(records, PAT, settings):
+    # url -> (outcome, html_url or error)
+    pull_requests = settings['pull_requests']
+    client = make_github_client(PAT, pull_requests)
+    outcomes = {}
+    with concurrent_futures.ThreadPoolExecutor(max_workers=int(pull_requests.get('max_concurrency', 4))) as executor:
+        futures = {record["url"]: executor.submit(open_pull_request, client, record, settings) for record in records}
+    for url, future in futures.items():
+        try:
+            outcomes[url] = future.result()
+        except GitHubError as e:
+            print(f"Could not open a pull request for {url}: {e}")
+            outcomes[url] = ("failed", str(e))
+    save_etag_cache(client, pull_requests)
+    return outcomes
+
+
+# Audit: which repos would change, without changing anything. Every repo is
+# cloned bare (depth 1), its manifests are read from blobs through the
+# backend's persistent object reader and the rules run in memory, so nothing
+# is written but the object store. Exits 2 when some repo has pending
+# changes, 1 when some repo could not be audited.
+
+def audit_repo(repo, PAT, settings, pool=None):
+    clone_options = dict(clone_options_for(repo, settings), strategy="bare")
+    repo_name = clone_repo(repo['url'], PAT, settings['source_branch'], clone_options, settings['mirror_cache'],
+                           settings['git_backend'])
+    return transform_repo(repo_name, settings, pool=pool, discovery=discovery_for(repo, settings))
+
+
+def run_audit(repos, PAT, settings, pool=None):
+    pending = []
+    failed = []
     for repo in repos:
         url = repo['url']
-        print(f"Processing {url}...")
-        repo_name = clone_repo(url, PAT, source_branch)
-        repo_modified = False  # Initialize as False before processing files in the repo
-        for root, _, files in os.walk(repo_name):
-            for file in files:
-                if file.endswith(".yaml"):
-                    filepath = os.path.join(root, file)
-                    all_content = []
-                    with open(filepath, 'r') as f:
-                        all_documents = yaml.load_all(f)
-                        for doc in all_documents:
-                            all_content.append(doc)
-
-                    modified = apply_switches(all_content, switches, api_migration_pathway)
-                    if modified:
-                        repo_modified = True  # Set to True if any file is modified
-                        with open(filepath, 'w') as f:
-                            for idx, content in enumerate(all_content):
-                                if idx != 0:
-                                    f.write('---\n')  # Add a separator if this isn't the first document
-                                yaml.dump(content, f)
-
-        if repo_modified:  # Use repo_modified here
-            branch_created = create_branch_and_commit(repo_name, target_branch)
-            if branch_created:
-                report["modified"].append(repo_name)
-            else:
-                report["skipped"].append(repo_name)
+        print(f"Auditing {url}...")
+        try:
+            changes = audit_repo(repo, PAT, settings, pool)
+        except git_errors() as e:
+            print(f"An error occurred: {str(e)}")
+            failed.append(repo_name_from_url(url))
+            continue
+        for change in changes:
+            rules = ", ".join(f"{switch} x{hits}" for switch, hits in sorted(change["rules"].items()))
+            print(f"  {change['path']}: {rules}")
+        if changes:
+            pending.append(repo_name_from_url(url))
+    return pending, failed
+
+
+def audit_main(args):
+    PAT = read_env_variable()
+    project_data = read_project_file(args.config)
+    configure_logging(project_data.get('log_level', 'warning'))
+    repos = project_data.get('repos', [])
+    # the cache directory is a write too, and clear: on would wipe it
+    settings = load_settings(project_data, use_transform_cache=False)
+
+    if Path("audit_repos").exists():
+        shutil.rmtree("audit_repos")
+    Path("audit_repos").mkdir()
+    os.chdir("audit_repos")
+
+    pool = make_transform_pool(settings['transform'])
+    try:
+        pending, failed = run_audit(repos, PAT, settings, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    print("Audit:")
+    print(f"Pending changes: {pending}")
+    print(f"Failed: {failed}")
+    if failed:
+        exit(1)
+    if pending:
+        exit(2)
+
+
+# Daemon: a long-running worker that keeps the settings, compiled rules,
+# transform pool, per-thread parsers and mirror cache warm between jobs.
+# A job is a JSON file shaped like an entry of repos in projects.yaml
+# ({"url": ...}) dropped into <spool>/incoming, or POSTed to /jobs on
+# 127.0.0.1:<http_port>. Jobs are claimed by renaming them into processing
+# and end up in done or failed with the repo's report record added.
+
+SPOOL_DIRS = ["incoming", "processing", "done", "failed"]
+
+
+def open_spool(spool):
+    for name in SPOOL_DIRS:
+        Path(spool, name).mkdir(parents=True, exist_ok=True)
+    # jobs a previous daemon was working on when it stopped are retried
+    for job in Path(spool, "processing").iterdir():
+        os.replace(job, Path(spool, "incoming", job.name))
+
+
+def enqueue_job(spool, job):
+    name = f"{time.time_ns()}-{os.getpid()}-{threading.get_ident()}.json"
+    tmp = Path(spool, name + ".tmp")
+    tmp.write_text(json.dumps(job))
+    os.replace(tmp, Path(spool, "incoming", name))  # a job appears in incoming complete or not at all
+    return name
+
+
+def claim_jobs(spool, limit):
+    claimed = []
+    for job in sorted(Path(spool, "incoming").glob("*.json")):
+        if len(claimed) >= limit:
+            break
+        target = Path(spool, "processing", job.name)
+        try:
+            os.rename(job, target)
+        except FileNotFoundError:
+            continue  # another daemon on the same spool got it first
+        claimed.append(target)
+    return claimed
+
+
+def finish_job(spool, job_path, job, record=None, error=None):
+    state = "done" if error is None else "failed"
+    job = dict(job, record=record, error=error)
+    Path(job_path).write_text(json.dumps(job))
+    os.replace(job_path, Path(spool, state, Path(job_path).name))
+
+
+def make_job_server(spool, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class JobHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/jobs":
+                self.send_error(404)
+                return
+            try:
+                job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if not isinstance(job, dict) or not job.get("url"):
+                    raise ValueError("a job needs a url")
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            body = json.dumps({"job": enqueue_job(spool, job)}).encode()
+            self.send_response(202)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format, *args)
+
+    # loopback only: whoever can reach this can make k8zilla push branches
+    server = ThreadingHTTPServer(("127.0.0.1", int(port)), JobHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_daemon(PAT, settings, daemon, stop):
+    spool = os.path.abspath(daemon.get('spool', 'k8zilla-spool'))
+    workers = int(daemon.get('workers', 2))
+    poll_seconds = float(daemon.get('poll_seconds', 2))
+    maintenance_seconds = float(daemon.get('maintenance_minutes', 10)) * 60
+    open_spool(spool)
+    server = make_job_server(spool, daemon['http_port']) if daemon.get('http_port') else None
+
+    Path("daemon_repos").mkdir(exist_ok=True)
+    os.chdir("daemon_repos")
+    pool = make_transform_pool(settings['transform'])
+    run_report = open_run_report("report.jsonl", "a")
+    repo_locks = {}
+    repo_locks_lock = threading.Lock()
+    jobs_done = 0
+    in_flight = threading.Semaphore(workers)
+    github = None
+    if settings['pull_requests'].get('enabled', 'off') == 'on':
+        github = make_github_client(PAT, settings['pull_requests'])
+
+    def evict_caches():
+        if settings['mirror_cache'].get('enabled', 'off') == 'on':
+            evict_mirrors(settings['mirror_cache'])
+        if settings['transform_cache'] is not None:
+            evict_transform_cache(settings['transform_cache'])
+
+    def work(job_path, index):
+        try:
+            run_job(job_path, index)
+        finally:
+            in_flight.release()
+
+    def run_job(job_path, index):
+        try:
+            job = json.loads(Path(job_path).read_text())
+        except ValueError as e:
+            finish_job(spool, job_path, {}, error=f"unreadable job: {e}")
+            return
+        repo_name = repo_name_from_url(job.get('url', ''))
+        with repo_locks_lock:
+            repo_lock = repo_locks.setdefault(repo_name, threading.Lock())
+        try:
+            # two jobs for one repo would share its working copy
+            with repo_lock:
+                record = process_repo(index, job, PAT, settings, run_report, pool, parser=thread_yaml())
+                if Path(repo_name).exists():
+                    shutil.rmtree(repo_name)
+            if github is not None and record["outcome"] == "modified":
+                try:
+                    record["pull_request"] = open_pull_request(github, record, settings)[1]
+                except GitHubError as e:
+                    print(f"Could not open a pull request for {record['url']}: {e}")
+                    record["pull_request_error"] = str(e)
+        except Exception as e:
+            print(f"An error occurred: {str(e)}, skipping...")
+            finish_job(spool, job_path, job, error=str(e))
         else:
-            report["not_modified"].append(repo_name)
+            finish_job(spool, job_path, job, record)
+
+    print(f"Waiting for jobs in {spool}" + (f" and on http://127.0.0.1:{daemon['http_port']}/jobs" if server else ""))
+    executor = concurrent_futures.ThreadPoolExecutor(max_workers=workers)
+    last_maintenance = time.monotonic()
+    try:
+        while not stop.is_set():
+            # only claim what a worker is free to start, so other daemons on
+            # the same spool can take the rest
+            free = 0
+            while free < workers and in_flight.acquire(blocking=False):
+                free += 1
+            claimed = claim_jobs(spool, free)
+            for _ in range(free - len(claimed)):
+                in_flight.release()
+            for job_path in claimed:
+                executor.submit(work, job_path, jobs_done)
+                jobs_done += 1
+            if not claimed:
+                # caches are only trimmed while no job could be using them
+                if free == workers and time.monotonic() - last_maintenance >= maintenance_seconds:
+                    evict_caches()
+                    last_maintenance = time.monotonic()
+                stop.wait(poll_seconds)
+    finally:
+        if server is not None:
+            server.shutdown()
+        executor.shutdown(wait=True)
+        run_report["file"].close()
+        if github is not None:
+            save_etag_cache(github, settings['pull_requests'])
+        if pool is not None:
+            pool.shutdown()
+        evict_caches()
+
+
+def daemon_main(args):
+    PAT = read_env_variable()
+    project_data = read_project_file(args.config)
+    configure_logging(project_data.get('log_level', 'info'))
+    settings = load_settings(project_data)
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping after the jobs in progress...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    run_daemon(PAT, settings, project_data.get('daemon', {}), stop)
+
+
+# validate-config: everything load_settings would trip over later, checked
+# without cloning, importing GitPython or touching the network.
+
+CLONE_STRATEGIES = ["full", "shallow", "blobless", "sparse", "bare"]
+CHOICES = {
+    ('commit', 'mode'): ["worktree", "plumbing"],
+    ('transform', 'writer'): ["patch", "dump"],
+    ('transform', 'streaming'): ["on", "off", "auto"],
+    ('transform', 'analysis'): ["on", "off"],
+}
 
 
+def config_problems(project_data):
+    problems = []
+    repos = project_data.get('repos') or []
+    if not repos:
+        problems.append("repos is empty")
+    for i, repo in enumerate(repos):
+        if not isinstance(repo, dict) or not repo.get('url'):
+            problems.append(f"repos[{i}] has no url")
+            continue
+        strategy = (repo.get('clone') or {}).get('strategy')
+        if strategy is not None and strategy not in CLONE_STRATEGIES:
+            problems.append(f"repos[{i}] has unknown clone strategy {strategy}")
+    strategy = (project_data.get('clone') or {}).get('strategy', 'full')
+    if strategy not in CLONE_STRATEGIES:
+        problems.append(f"unknown clone strategy {strategy}, expected one of {', '.join(CLONE_STRATEGIES)}")
+
+    switches = {rule.switch for rule in RULES}
+    for switch, value in (project_data.get('switches') or {}).items():
+        if switch not in switches:
+            problems.append(f"unknown switch {switch}")
+        elif value not in ("on", "off"):
+            problems.append(f"switch {switch} should be on or off, not {value}")
+    try:
+        compile_api_migrations(project_data.get('api_migration_pathway') or [])
+    except ValueError as e:
+        problems.append(str(e))
+
+    for i, entry in enumerate(project_data.get('pod_specs') or []):
+        if not isinstance(entry, dict) or not entry.get('kind') or not entry.get('path'):
+            problems.append(f"pod_specs[{i}] needs a kind and a path")
+
+    for (block, key), choices in CHOICES.items():
+        value = (project_data.get(block) or {}).get(key)
+        if value is not None and value not in choices:
+            problems.append(f"{block}.{key} should be one of {', '.join(choices)}, not {value}")
+    backend = project_data.get('git_backend', 'gitpython')
+    if backend not in GIT_BACKENDS:
+        problems.append(f"unknown git_backend {backend}, expected one of {', '.join(GIT_BACKENDS)}")
+    api_url = (project_data.get('pull_requests') or {}).get('api_url')
+    if api_url and urlsplit(api_url).scheme not in ("http", "https"):
+        problems.append(f"pull_requests.api_url should be an http(s) URL, not {api_url}")
+    level = project_data.get('log_level', 'info')
+    if not isinstance(logging.getLevelName(str(level).upper()), int):
+        problems.append(f"unknown log_level {level}")
+    return problems
+
+
+def validate_config_main(args):
+    problems = config_problems(read_project_file(args.config))
+    for problem in problems:
+        print(f"{args.config}: {problem}")
+    if problems:
+        exit(1)
+    print(f"{args.config} is valid")
+
+
+def harden_file_main(args):
+    # The switches of projects.yaml applied to local files, outside any repo
+    project_data = read_project_file(args.config)
+    configure_logging(project_data.get('log_level', 'warning'))
+    rules = compile_rules(project_data.get('switches', {}), project_data.get('api_migration_pathway', []),
+                          project_data.get('pod_specs', []))
+    writer = project_data.get('transform', {}).get('writer', 'patch')
+    analysis = project_data.get('transform', {}).get('analysis', 'on') == 'on' and importlib.util.find_spec("yaml")
+    changed = []
+    for filepath in args.files:
+        result = transform_file(filepath, rules, thread_yaml(), writer=writer, write=not args.dry_run,
+                                analysis=bool(analysis))
+        if not result["modified"]:
+            continue
+        changed.append(filepath)
+        if args.dry_run:
+            import difflib
+            with open(filepath, encoding='utf-8') as f:
+                before = f.read().splitlines(keepends=True)
+            after = result["output"].decode('utf-8').splitlines(keepends=True)
+            sys.stdout.writelines(difflib.unified_diff(before, after, filepath, filepath))
+        else:
+            print(f"Hardened {filepath}")
+    if args.dry_run and changed:
+        exit(2)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="k8zilla", description="Harden Kubernetes manifests across git repos.")
+    parser.add_argument("--config", default="projects.yaml", help="project file (default: projects.yaml)")
+    parser.set_defaults(command="run", resume=False, yes=False)
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="harden every repo in the project file and push branches (default)")
+    run.add_argument("--resume", action="store_true", help="continue an interrupted run from its journal")
+    run.add_argument("-y", "--yes", action="store_true", help="skip the confirmation prompt")
+    commands.add_parser("audit", help="report which repos would change, without changing anything")
+    commands.add_parser("daemon", help="serve repo jobs from the spool in the project file")
+    commands.add_parser("validate-config", help="check the project file and exit")
+    harden_file = commands.add_parser("harden-file", help="apply the switches to local manifest files")
+    harden_file.add_argument("files", nargs="+")
+    harden_file.add_argument("--dry-run", action="store_true", help="print a diff instead of writing")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    COMMANDS[args.command or "run"](args)
+
+
+def run_main(args):
+    resume = args.resume
+    if not args.yes:
+        print_k8zilla()
+        display_message_and_wait()
+
+    PAT = read_env_variable()
+    project_data = read_project_file(args.config)
+    configure_logging(project_data.get('log_level', 'info'))
+    repos = project_data.get('repos', [])
+    settings = load_settings(project_data)
+    run_profile["slowest_limit"] = int(settings['profile'].get('slowest_files', 20))
+    started = time.perf_counter()
+    journal, state = open_journal(os.path.abspath(project_data.get('journal', 'k8zilla-journal.jsonl')),
+                                  settings, resume)
+
+    # a resumed run continues in the working copies the interrupted one left
+    if Path("temp_repos").exists() and not resume:
+        shutil.rmtree("temp_repos")
+    Path("temp_repos").mkdir(exist_ok=True)
+    os.chdir("temp_repos")
+
+    remote_refs = None
+    if settings['preflight'].get("enabled", "on") == "on":
+        with timed("preflight"):
+            remote_refs = preflight(repos, PAT, settings)
+
+    pool = make_transform_pool(settings['transform'])
+    run_report = open_run_report("report.jsonl", "a" if resume else "w")
+    try:
+        if settings['pipeline'].get("enabled", "off") == "on":
+            run_pipeline(repos, PAT, settings, run_report, pool, remote_refs, journal, state)
+        else:
+            run_sequential(repos, PAT, settings, run_report, pool, remote_refs, journal, state)
+    finally:
+        run_report["file"].close()
+        journal["file"].close()
+        if pool is not None:
+            pool.shutdown()
+    if settings['mirror_cache'].get('enabled', 'off') == 'on':
+        evict_mirrors(settings['mirror_cache'], [repo['url'] for repo in repos])
+    if settings['transform_cache'] is not None:
+        evict_transform_cache(settings['transform_cache'])
+    report, pushed = summarize_run_report(run_report["path"])
+    pull_requests = None
+    if settings['pull_requests'].get('enabled', 'off') == 'on':
+        with timed("pull_requests"):
+            outcomes = open_pull_requests(pushed, PAT, settings)
+        pull_requests = {"opened": [], "exists": [], "failed": []}
+        for record in pushed:
+            pull_requests[outcomes[record["url"]][0]].append(record["repo"])
+    if settings['profile'].get('enabled', 'off') == 'on':
+        profile = write_profile(settings['profile'], time.perf_counter() - started)
+        print("Slowest phases: " + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in
+                                              sorted(profile["phases"].items(), key=lambda item: -item[1])))
 
     print("Report:")
     print(f"Modified: {report['modified']}")
     print(f"Not Modified: {report['not_modified']}")
     print(f"Skipped: {report['skipped']}")
+    print(f"Files prefiltered: {run_stats['files_prefiltered']} of {run_stats['files_seen']}")
+    if settings['transform_cache'] is not None:
+        print(f"Transform cache hits: {run_stats.get('transform_cache_hit', 0)}, "
+              f"misses: {run_stats.get('transform_cache_miss', 0)}")
+    if settings['analysis']:
+        print(f"Files left unchanged without a ruamel parse: {run_stats.get('files_ruamel_skipped', 0)}")
+    if run_stats.get('remote_retries'):
+        print(f"Remote git operations retried: {run_stats['remote_retries']}")
+    if pull_requests is not None:
+        print(f"Pull requests opened: {pull_requests['opened']}, already open: {pull_requests['exists']}, "
+              f"failed: {pull_requests['failed']}")
     with open("report.txt", "w") as f:
         f.write("Report:\n")
         f.write(f"Modified: {report['modified']}\n")
         f.write(f"Not Modified: {report['not_modified']}\n")
         f.write(f"Skipped: {report['skipped']}\n")
+        f.write(f"Files prefiltered: {run_stats['files_prefiltered']} of {run_stats['files_seen']}\n")
+        if pull_requests is not None:
+            f.write(f"Pull requests opened: {pull_requests['opened']}\n")
+            f.write(f"Pull requests already open: {pull_requests['exists']}\n")
+            f.write(f"Pull requests failed: {pull_requests['failed']}\n")
+
+
+COMMANDS = {
+    "run": run_main,
+    "audit": audit_main,
+    "daemon": daemon_main,
+    "validate-config": validate_config_main,
+    "harden-file": harden_file_main,
+}
+
 
 def display_message_and_wait():
     print("Welcome to k8zilla! Before you run this ensure you have performed all these steps:")
@@ -0,0 +1,505 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import py_compile
+import statistics
+import subprocess
+from pathlib import Path
+
+import k8zilla
+
+# Benchmarks the k8zilla phases against a generated fleet of local bare
+# repos, so a change to the rules, the parser or the git handling can be
+# measured before and after. Results go to a JSON file; pass an earlier one
+# with --compare to see the ratio per phase.
+#
+#   python k8zilla_bench.py --repos 20 --files 50 --output before.json
+#   git checkout my-branch
+#   python k8zilla_bench.py --repos 20 --files 50 --compare before.json
+#
+# --startup instead checks the CLI start-up budget: how much slower than a
+# bare interpreter the quick commands start, and that importing k8zilla
+# leaves GitPython and ruamel unimported. It exits 1 when over budget.
+#
+# --parity runs both parsing tiers over every manifest of the fleet and
+# exits 1 when the libyaml analysis and the ruamel round trip disagree on
+# which files need changes.
+
+PHASES = ["clone", "discover", "parse", "transform", "dump", "commit", "push"]
+
+SOURCE_BRANCH = "main"
+TARGET_BRANCH = "fix_automata"
+
+WORKLOAD_KINDS = ['Deployment', 'StatefulSet', 'DaemonSet', 'CronJob', 'Job', 'Pod']
+
+SWITCHES = {
+    'vault_command': 'on',
+    'nonroot': 'on',
+    'previlege_escalation': 'on',
+    'upgrade_apis': 'on',
+    'remove_rootaszero': 'on',
+}
+
+API_MIGRATION_PATHWAY = [
+    {'kind': 'cronjob', 'from_api_version': 'batch/v1beta1', 'to_api_version': 'batch/v1', 'strategy': 'native'},
+    {'kind': 'role', 'from_api_version': 'rbac.authorization.k8s.io/v1beta1',
+     'to_api_version': 'rbac.authorization.k8s.io/v1', 'strategy': 'native'},
+    {'kind': 'deployment', 'from_api_version': 'extensions/v1beta1', 'to_api_version': 'apps/v1',
+     'strategy': 'native'},
+    {'kind': 'poddisruptionbudget', 'from_api_version': 'policy/v1beta1', 'to_api_version': 'policy/v1',
+     'strategy': 'native'},
+]
+
+
+# Fleet generator
+
+def container(rng, name, vault=False, hardened=False):
+    lines = [
+        f"- name: {name}",
+        f"  image: registry.example.com/{name}:{rng.randint(1, 40)}.{rng.randint(0, 9)}",
+    ]
+    if vault:
+        lines.append('  command: ["/vault/vault-env", "/app/start.sh"]')
+    else:
+        lines.append('  command: ["sh", "-c", "exec /app/start.sh"]')
+    lines += [
+        "  ports:",
+        f"  - containerPort: {rng.choice([80, 8080, 8443, 9090])}",
+        "  env:",
+    ]
+    for i in range(rng.randint(1, 6)):
+        lines += [f"  - name: SETTING_{i}", f"    value: \"{rng.getrandbits(32):08x}\""]
+    if hardened:
+        lines += ["  securityContext:", "    runAsNonRoot: true", "    allowPrivilegeEscalation: false"]
+    elif rng.random() < 0.4:
+        lines += ["  securityContext:", f"    runAsUser: {rng.choice([0, 1000])}"]
+        if rng.random() < 0.5:
+            lines.append("    allowPrivilegeEscalation: true")
+    if rng.random() < 0.5:
+        lines += ["  resources:", "    limits:", "      cpu: 500m", "      memory: 256Mi"]
+    return lines
+
+
+def pod_spec(rng, name, hardened=False):
+    lines = []
+    if rng.random() < 0.4:
+        lines.append("initContainers:")
+        lines += container(rng, f"{name}-init", hardened=hardened)
+    lines.append("containers:")
+    for i in range(rng.randint(1, 3)):
+        lines += container(rng, f"{name}-{i}", vault=rng.random() < 0.2, hardened=hardened)
+    if rng.random() < 0.3:
+        lines += ["securityContext:", "  runAsUser: 0"]
+    lines += ["volumes:", "- name: data", "  emptyDir: {}"]
+    return lines
+
+
+def indent(lines, spaces):
+    return [" " * spaces + line if line else line for line in lines]
+
+
+def metadata(name):
+    return ["metadata:", f"  name: {name}", "  labels:", f"    app: {name}", "    # managed by the platform team"]
+
+
+def workload(rng, kind, name, hardened=False):
+    api_version = {
+        'Deployment': rng.choice(["apps/v1", "apps/v1", "extensions/v1beta1"]),
+        'StatefulSet': "apps/v1",
+        'DaemonSet': "apps/v1",
+        'Job': "batch/v1",
+        'CronJob': rng.choice(["batch/v1", "batch/v1beta1"]),
+        'Pod': "v1",
+    }[kind]
+    if hardened:
+        api_version = {'Deployment': "apps/v1", 'CronJob': "batch/v1"}.get(kind, api_version)
+    lines = [f"apiVersion: {api_version}", f"kind: {kind}"] + metadata(name)
+    template = ["template:", "  metadata:", "    labels:", f"      app: {name}", "  spec:"] + \
+        indent(pod_spec(rng, name, hardened), 4)
+    if kind == 'Pod':
+        lines += ["spec:"] + indent(pod_spec(rng, name, hardened), 2)
+    elif kind == 'CronJob':
+        lines += ["spec:", "  schedule: \"*/5 * * * *\"", "  jobTemplate:", "    spec:"] + indent(template, 6)
+    elif kind == 'Job':
+        lines += ["spec:"] + indent(template, 2)
+    else:
+        lines += ["spec:", "  replicas: 2", "  selector:", "    matchLabels:", f"      app: {name}"] + \
+            indent(template, 2)
+    return lines
+
+
+def config_map(rng, name, size_kb):
+    lines = ["apiVersion: v1", "kind: ConfigMap"] + metadata(name) + ["data:", "  settings.properties: |"]
+    size = 0
+    while size < size_kb * 1024:
+        line = f"    key.{rng.getrandbits(32):08x}={rng.getrandbits(128):032x}"
+        lines.append(line)
+        size += len(line) + 1
+    return lines
+
+
+def other_document(rng, name, hardened=False):
+    kind = rng.choice(["Service", "Role", "PodDisruptionBudget"])
+    if kind == "Service":
+        return ["apiVersion: v1", "kind: Service"] + metadata(name) + \
+            ["spec:", "  selector:", f"    app: {name}", "  ports:", "  - port: 80", "    targetPort: 8080"]
+    if kind == "Role":
+        api_version = rng.choice(["rbac.authorization.k8s.io/v1", "rbac.authorization.k8s.io/v1beta1"])
+        if hardened:
+            api_version = "rbac.authorization.k8s.io/v1"
+        return [f"apiVersion: {api_version}", "kind: Role"] + metadata(name) + \
+            ["rules:", "- apiGroups: [\"\"]", "  resources: [\"pods\"]", "  verbs: [\"get\", \"list\"]"]
+    api_version = "policy/v1" if hardened else rng.choice(["policy/v1", "policy/v1beta1"])
+    return [f"apiVersion: {api_version}", "kind: PodDisruptionBudget"] + metadata(name) + \
+        ["spec:", "  minAvailable: 1", "  selector:", "    matchLabels:", f"      app: {name}"]
+
+
+def document(rng, name, params, hardened=False):
+    roll = rng.random()
+    if roll < 0.6:
+        return workload(rng, rng.choice(WORKLOAD_KINDS), name, hardened)
+    if roll < 0.6 + params['configmap_ratio']:
+        return config_map(rng, name, params['configmap_kb'])
+    return other_document(rng, name, hardened)
+
+
+def manifest(rng, name, params):
+    # hardened files already have everything the switches would set
+    hardened = rng.random() < params['hardened_ratio']
+    documents = 1
+    if rng.random() < params['multi_document_ratio']:
+        documents = rng.randint(2, params['max_documents'])
+    chunks = ["\n".join(document(rng, f"{name}-{i}", params, hardened)) + "\n" for i in range(documents)]
+    return "---\n".join(chunks)
+
+
+def git_cmd(*args, cwd=None):
+    subprocess.run(["git", "-c", "user.name=k8zilla-bench", "-c", "user.email=bench@k8zilla.invalid", *args],
+                   cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def generate_fleet(fleet_dir, params):
+    # Regenerated only when the parameters change, so repeated runs (and runs
+    # on different commits) measure the exact same fleet.
+    params_path = Path(fleet_dir, "params.json")
+    if params_path.exists() and json.loads(params_path.read_text()) == params:
+        return sorted(str(path) for path in Path(fleet_dir, "remotes").glob("*.git"))
+    if Path(fleet_dir).exists():
+        shutil.rmtree(fleet_dir)
+    rng = random.Random(params['seed'])
+    remotes = []
+    for r in range(params['repos']):
+        name = f"bench-app-{r:03d}"
+        seed_dir = Path(fleet_dir, "seed", name)
+        for f in range(params['files']):
+            filepath = Path(seed_dir, "k8s", f"dir-{f % 5}", f"{name}-{f:04d}.yaml")
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            filepath.write_text(manifest(rng, f"{name}-{f:04d}", params))
+        Path(seed_dir, "README.md").write_text(f"# {name}\n")
+        git_cmd("init", "-q", "-b", SOURCE_BRANCH, str(seed_dir))
+        git_cmd("add", "-A", cwd=seed_dir)
+        git_cmd("commit", "-q", "-m", "Initial manifests", cwd=seed_dir)
+        remote = Path(fleet_dir, "remotes", f"{name}.git")
+        git_cmd("clone", "-q", "--bare", str(seed_dir), str(remote))
+        remotes.append(str(remote))
+    shutil.rmtree(Path(fleet_dir, "seed"))
+    params_path.write_text(json.dumps(params, sort_keys=True))
+    return remotes
+
+
+# Phases
+
+class PhaseTimer:
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+
+    def time(self, phase, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.seconds[phase] += time.perf_counter() - start
+
+
+def parse_files(filepaths, parser):
+    parsed = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            text = f.read().decode('utf-8')
+        parsed.append((filepath, text, list(parser.load_all(text))))
+    return parsed
+
+
+def transform_files(parsed, rules, writer):
+    transformed = []
+    for filepath, text, all_content in parsed:
+        # as in k8zilla.transform_file, only files a rule changed are written
+        edits = []
+        k8zilla.apply_rules(all_content, rules, edits)
+        if edits:
+            transformed.append((filepath, text, all_content, edits if writer == "patch" else None))
+    return transformed
+
+
+def dump_files(transformed, parser):
+    outputs = {}
+    for filepath, text, all_content, edits in transformed:
+        patched = k8zilla.render_edits(text, edits) if edits is not None else None
+        if patched is None:
+            buffer = io.StringIO()
+            for i, content in enumerate(all_content):
+                if i > 0:
+                    buffer.write('---\n')
+                parser.dump(content, buffer)
+            patched = buffer.getvalue()
+        if patched != text:
+            outputs[filepath] = patched.encode('utf-8')
+    return outputs
+
+
+def commit_files(repo_name, outputs, backend):
+    for filepath, output in outputs.items():
+        k8zilla.write_atomically(filepath, output)
+    backend.create_branch(repo_name, TARGET_BRANCH)
+    backend.commit_all(repo_name, k8zilla.COMMIT_MESSAGE)
+
+
+def reset_target_branch(remote):
+    subprocess.run(["git", "--git-dir", remote, "branch", "-D", TARGET_BRANCH],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def bench_repo(remote, rules, params, timer):
+    parser = k8zilla.make_yaml()
+    backend = k8zilla.make_git_backend(params['git_backend'])
+    url = Path(remote).as_uri()
+    repo_name = k8zilla.repo_name_from_url(url)
+    reset_target_branch(remote)
+
+    timer.time("clone", k8zilla.clone_repo, url, "bench", SOURCE_BRANCH, {'strategy': params['clone']}, None,
+               backend)
+    filepaths = timer.time("discover", lambda: list(k8zilla.discover_manifests(repo_name)))
+    parsed = timer.time("parse", parse_files, filepaths, parser)
+    transformed = timer.time("transform", transform_files, parsed, rules, params['writer'])
+    outputs = timer.time("dump", dump_files, transformed, parser)
+    if outputs:
+        timer.time("commit", commit_files, repo_name, outputs, backend)
+        timer.time("push", backend.push, repo_name, TARGET_BRANCH)
+    reset_target_branch(remote)
+    return {
+        "files": len(filepaths),
+        "documents": sum(len(all_content) for _, _, all_content in parsed),
+        "bytes": sum(len(text) for _, text, _ in parsed),
+        "modified_files": len(outputs),
+    }
+
+
+def run_once(remotes, params, work_dir):
+    rules = k8zilla.compile_rules(SWITCHES, API_MIGRATION_PATHWAY)
+    if Path(work_dir).exists():
+        shutil.rmtree(work_dir)
+    Path(work_dir).mkdir(parents=True)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    timer = PhaseTimer()
+    totals = {"files": 0, "documents": 0, "bytes": 0, "modified_files": 0}
+    start = time.perf_counter()
+    try:
+        for remote in remotes:
+            for key, value in bench_repo(remote, rules, params, timer).items():
+                totals[key] += value
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    totals["wall_seconds"] = time.perf_counter() - start
+    totals["phases"] = timer.seconds
+    return totals
+
+
+def parity_check(remotes, writer):
+    # The fast tier may send a file to ruamel for nothing, but it must never
+    # call a file unchanged that the ruamel round trip would rewrite.
+    rules = k8zilla.compile_rules(SWITCHES, API_MIGRATION_PATHWAY)
+    parser = k8zilla.make_yaml()
+    backend = k8zilla.GitPythonBackend()
+    seconds = {"fast": 0.0, "ruamel": 0.0}
+    files, unloadable, missed, wasted = 0, [], [], []
+    for remote in remotes:
+        for path, data in backend.read_blobs(remote, SOURCE_BRANCH, k8zilla.manifest_matcher()):
+            files += 1
+            start = time.perf_counter()
+            rewrite = k8zilla.needs_rewrite(data.decode('utf-8'), rules)
+            analyzed = time.perf_counter()
+            modified = k8zilla.transform_file(path, rules, parser, writer=writer, data=data, write=False)["modified"]
+            seconds["fast"] += analyzed - start
+            seconds["ruamel"] += time.perf_counter() - analyzed
+            name = f"{Path(remote).name}/{path}"
+            if rewrite is None:
+                unloadable.append(name)
+            elif modified and not rewrite:
+                missed.append(name)
+            elif rewrite and not modified:
+                wasted.append(name)
+    print(f"{files} files: fast tier {seconds['fast']:.2f}s, ruamel round trip {seconds['ruamel']:.2f}s")
+    if unloadable:
+        print(f"{len(unloadable)} files PyYAML cannot load, left to ruamel")
+    for label, names in (("rewritten by ruamel but not flagged by the fast tier", missed),
+                         ("flagged by the fast tier but left unchanged by ruamel", wasted)):
+        if names:
+            print(f"{len(names)} files {label}:")
+            for name in names[:20]:
+                print(f"  {name}")
+    return not missed and not wasted
+
+
+# Milliseconds over a bare `python -c pass`, median of several starts
+STARTUP_BUDGET_MS = {
+    "--help": 100,
+    "validate-config": 175,
+}
+LAZY_MODULES = ["git", "gitdb", "ruamel.yaml", "multiprocessing", "concurrent.futures"]
+# `python -c` imports from the working directory, so start next to k8zilla.py
+MODULE_DIR = Path(k8zilla.__file__).resolve().parent
+
+
+def start_ms(args, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL, cwd=MODULE_DIR)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def startup_check(config, repeat):
+    # the installed console script imports a compiled module, so measure that
+    py_compile.compile(k8zilla.__file__)
+    over = []
+    baseline = start_ms(["-c", "pass"], repeat)
+    for command, budget in STARTUP_BUDGET_MS.items():
+        argv = ["--config", config, command] if command != "--help" else [command]
+        overhead = start_ms(["-c", f"import k8zilla; k8zilla.main({argv!r})"], repeat) - baseline
+        print(f"  {command:<16} {overhead:6.1f} ms (budget {budget} ms)")
+        if overhead > budget:
+            over.append(command)
+    imported = subprocess.run([sys.executable, "-c", f"import sys, k8zilla; print(' '.join(m for m in "
+                               f"{LAZY_MODULES!r} if m in sys.modules))"],
+                              check=True, capture_output=True, text=True, cwd=MODULE_DIR).stdout.split()
+    if imported:
+        print(f"Importing k8zilla also imports {', '.join(imported)}")
+    return not over and not imported
+
+
+def tool_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent,
+                            capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def summarize(runs):
+    summary = {phase: statistics.median(run["phases"][phase] for run in runs) for phase in PHASES}
+    summary["wall_seconds"] = statistics.median(run["wall_seconds"] for run in runs)
+    return summary
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline["params"] != results["params"]:
+        print("Warning: the baseline was measured with different parameters")
+    print(f"{'phase':<14}{'baseline s':>12}{'current s':>12}{'ratio':>8}")
+    for phase in PHASES + ["wall_seconds"]:
+        before = baseline["median"][phase]
+        after = results["median"][phase]
+        ratio = after / before if before else float('nan')
+        print(f"{phase:<14}{before:>12.3f}{after:>12.3f}{ratio:>8.2f}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark k8zilla against a generated fleet of local repos.")
+    parser.add_argument("--repos", type=int, default=10)
+    parser.add_argument("--files", type=int, default=40, help="manifest files per repo")
+    parser.add_argument("--multi-document-ratio", type=float, default=0.3)
+    parser.add_argument("--max-documents", type=int, default=6)
+    parser.add_argument("--configmap-ratio", type=float, default=0.15)
+    parser.add_argument("--configmap-kb", type=int, default=64)
+    parser.add_argument("--hardened-ratio", type=float, default=0.3, help="files that need no changes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--writer", choices=["patch", "dump"], default="patch")
+    parser.add_argument("--clone", choices=["full", "shallow", "blobless", "bare"], default="full")
+    parser.add_argument("--git-backend", choices=sorted(k8zilla.GIT_BACKENDS), default="gitpython")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fleet-dir", default="bench_fleet")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--startup", action="store_true", help="only check the CLI start-up budget")
+    parser.add_argument("--parity", action="store_true", help="only check that both parsing tiers agree")
+    parser.add_argument("--config", default="projects.yaml", help="project file for the start-up check")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.startup:
+        print("Start-up over a bare interpreter:")
+        if not startup_check(os.path.abspath(args.config), max(args.repeat, 5)):
+            exit(1)
+        return
+    if args.clone == "bare":
+        # the commit and push phases here need a working tree
+        print("The bare clone strategy is not supported by the benchmark.")
+        exit(1)
+    fleet_params = {
+        'repos': args.repos,
+        'files': args.files,
+        'multi_document_ratio': args.multi_document_ratio,
+        'max_documents': args.max_documents,
+        'configmap_ratio': args.configmap_ratio,
+        'configmap_kb': args.configmap_kb,
+        'hardened_ratio': args.hardened_ratio,
+        'seed': args.seed,
+    }
+    params = dict(fleet_params, writer=args.writer, clone=args.clone, git_backend=args.git_backend)
+
+    fleet_dir = os.path.abspath(args.fleet_dir)
+    start = time.perf_counter()
+    remotes = generate_fleet(fleet_dir, fleet_params)
+    print(f"Fleet of {len(remotes)} repos ready in {time.perf_counter() - start:.1f}s")
+    if args.parity:
+        if not parity_check(remotes, args.writer):
+            exit(1)
+        return
+
+    runs = []
+    for i in range(args.repeat):
+        run = run_once(remotes, params, os.path.join(fleet_dir, "work"))
+        print(f"Run {i + 1}/{args.repeat}: {run['wall_seconds']:.2f}s, "
+              f"{run['files']} files, {run['modified_files']} modified")
+        runs.append(run)
+
+    results = {
+        "tool_version": k8zilla.TOOL_VERSION,
+        "commit": tool_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "runs": runs,
+        "median": summarize(runs),
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    for phase in PHASES:
+        print(f"  {phase:<10} {results['median'][phase]:.3f}s")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,135 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import k8zilla
+
+CRONJOB = """apiVersion: batch/v1beta1
+kind: CronJob
+metadata:
+  name: c  # keep me
+spec:
+  schedule: "* * * * *"
+  jobTemplate:
+    spec:
+      template:
+        spec:
+          containers:
+            - name: a
+              image: vault:1
+              securityContext:
+                runAsUser: 0
+"""
+HARDENED = """apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: done
+spec:
+  template:
+    spec:
+      containers:
+        - name: a
+          image: nginx
+          securityContext: {runAsNonRoot: true, allowPrivilegeEscalation: false}
+"""
+CONFIG_MAP = "apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: cm\ndata:\n  a: b\n"
+APP_FILES = {"k8s/cron.yaml": CRONJOB, "k8s/hardened.yaml": HARDENED, "k8s/cm.yaml": CONFIG_MAP,
+             "README.md": "hi\n"}
+SWITCHES = {switch: "on" for switch in
+            ["vault_command", "nonroot", "remove_rootaszero", "previlege_escalation", "upgrade_apis"]}
+PATHWAY = [{"kind": "cronjob", "from_api_version": "batch/v1beta1", "to_api_version": "batch/v1",
+            "strategy": "native"}]
+
+
+def git(*args, cwd=None):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+
+@pytest.fixture(scope="session", autouse=True)
+def git_identity(tmp_path_factory):
+    # commits need an author, and the runner's own git config stays out of it
+    home = tmp_path_factory.mktemp("home")
+    (home / ".gitconfig").write_text("[user]\n\tname = k8zilla\n\temail = k8zilla@example.com\n"
+                                     "[init]\n\tdefaultBranch = main\n")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("HOME", str(home))
+        monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+        yield
+
+
+@pytest.fixture(autouse=True)
+def remote_limits():
+    # load_settings configures the shared scheduler, put it back afterwards
+    yield k8zilla.remote_scheduler
+    k8zilla.remote_scheduler.configure({})
+
+
+@pytest.fixture
+def make_remote(tmp_path):
+    # a bare repo with one commit on main holding files, as a file:// url
+    def make(name, files=APP_FILES):
+        source = tmp_path / "sources" / name
+        for path, text in files.items():
+            (source / path).parent.mkdir(parents=True, exist_ok=True)
+            (source / path).write_text(text)
+        git("init", "-q", "-b", "main", cwd=source)
+        git("add", "-A", cwd=source)
+        git("commit", "-qm", "init", cwd=source)
+        bare = tmp_path / "remotes" / f"{name}.git"
+        git("clone", "-q", "--bare", str(source), str(bare))
+        # partial clones fetch their missing blobs by id later on
+        git("config", "uploadpack.allowfilter", "true", cwd=bare)
+        git("config", "uploadpack.allowanysha1inwant", "true", cwd=bare)
+        return bare.as_uri()
+    return make
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    return work
+
+
+@pytest.fixture
+def project(workdir, monkeypatch):
+    # writes a project file for urls; keyword arguments replace top-level blocks
+    monkeypatch.setenv("K8_HARDEN_PAT", "x")
+
+    def write(urls, **blocks):
+        project_data = {
+            "repos": [{"url": url} for url in urls],
+            "switches": SWITCHES,
+            "api_migration_pathway": PATHWAY,
+            "source_branch": "main",
+            "target_branch": "fix_automata",
+            "journal": str(workdir / "k8zilla-journal.jsonl"),
+            "preflight": {"enabled": "off"},
+        }
+        project_data.update(blocks)
+        path = workdir / "projects.yaml"
+        path.write_text(json.dumps(project_data, indent=2))
+        return str(path)
+    return write
+
+
+def run(config, *args):
+    # one `k8zilla run`, from the directory holding the project file
+    os.chdir(os.path.dirname(config))
+    k8zilla.main(["--config", config, "run", "-y", *args])
+    return {record["repo"]: record for record in k8zilla.read_run_report("report.jsonl")}
+
+
+def remote_git(url, *args):
+    return git("--git-dir", url[len("file://"):], *args)
+
+
+def remote_file(url, branch, path):
+    return remote_git(url, "show", f"{branch}:{path}")
+
+
+def remote_branches(url):
+    return remote_git(url, "for-each-ref", "--format=%(refname:short)", "refs/heads").split()
@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+import k8zilla
+import k8zilla_bench
+
+SWITCHES = {switch: "on" for switch in
+            ["vault_command", "nonroot", "remove_rootaszero", "previlege_escalation", "upgrade_apis"]}
+PATHWAY = [{"kind": "cronjob", "from_api_version": "batch/v1beta1", "to_api_version": "batch/v1",
+            "strategy": "native"}]
+
+
+def pod(security_context):
+    return f"""apiVersion: v1
+kind: Pod
+metadata:
+  name: p
+spec:
+  containers:
+    - name: a
+      image: busybox
+      securityContext:
+{security_context}"""
+
+
+MANIFESTS = {
+    "hardened": pod("        runAsNonRoot: true\n        allowPrivilegeEscalation: false\n"),
+    "hardened_capitalised": pod("        runAsNonRoot: True\n        allowPrivilegeEscalation: FALSE\n"),
+    # YAML 1.1 booleans are plain strings to ruamel, which rewrites them
+    "yes_no": pod("        runAsNonRoot: yes\n        allowPrivilegeEscalation: no\n"),
+    "on_off": pod("        runAsNonRoot: on\n        allowPrivilegeEscalation: off\n"),
+    "quoted_true": pod("        runAsNonRoot: \"true\"\n        allowPrivilegeEscalation: false\n"),
+    "root_octal": pod("        runAsNonRoot: true\n        allowPrivilegeEscalation: false\n        runAsUser: 0o0\n"),
+    "root_hex": pod("        runAsNonRoot: true\n        allowPrivilegeEscalation: false\n        runAsUser: 0x0\n"),
+    "flow": pod("        {runAsNonRoot: true, allowPrivilegeEscalation: false}\n").replace(
+        "securityContext:\n        {", "securityContext: {").replace("}\n", "}\n", 1),
+    "bare": "apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: d\nspec:\n  template:\n    spec:\n"
+            "      containers:\n        - name: a\n          image: vault:1\n",
+    "old_api": "apiVersion: batch/v1beta1\nkind: CronJob\nmetadata:\n  name: c\nspec: {}\n",
+    "config_map": "apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: c\ndata:\n  enabled: yes\n",
+    "multi": "apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: c\n---\n" +
+             pod("        runAsNonRoot: yes\n        allowPrivilegeEscalation: false\n"),
+    "custom_tag": "apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: !Ref name\n",
+}
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return k8zilla.compile_rules(SWITCHES, PATHWAY)
+
+
+def ruamel_modifies(text, rules, writer):
+    result = k8zilla.transform_file("manifest.yaml", rules, k8zilla.make_yaml(), writer=writer,
+                                    data=text.encode(), write=False)
+    return result["modified"]
+
+
+@pytest.mark.parametrize("writer", ["patch", "dump"])
+@pytest.mark.parametrize("name", sorted(MANIFESTS))
+def test_tiers_agree(rules, writer, name):
+    text = MANIFESTS[name]
+    rewrite = k8zilla.needs_rewrite(text, rules)
+    # None leaves the decision to ruamel, which is always safe
+    if rewrite is not None:
+        assert rewrite == ruamel_modifies(text, rules, writer)
+
+
+@pytest.mark.parametrize("writer", ["patch", "dump"])
+def test_tiers_agree_on_generated_fleet(rules, writer):
+    rng = random.Random(7)
+    params = {"multi_document_ratio": 0.3, "max_documents": 4, "configmap_ratio": 0.1, "configmap_kb": 1,
+              "hardened_ratio": 0.4}
+    for i in range(60):
+        text = k8zilla_bench.manifest(rng, f"app-{i}", params)
+        assert k8zilla.needs_rewrite(text, rules) == ruamel_modifies(text, rules, writer), text
+
+
+def test_yaml_11_booleans_are_rewritten_with_analysis(rules):
+    data = MANIFESTS["yes_no"].encode()
+    with_analysis = k8zilla.transform_file("pod.yaml", rules, k8zilla.make_yaml(), data=data, write=False,
+                                           analysis=True)
+    without = k8zilla.transform_file("pod.yaml", rules, k8zilla.make_yaml(), data=data, write=False)
+    assert with_analysis["modified"] and without["modified"]
+    assert with_analysis["output"] == without["output"]
+    assert b"runAsNonRoot: true" in with_analysis["output"]
+
+
+def test_unchanged_files_skip_ruamel(rules):
+    result = k8zilla.transform_file("pod.yaml", rules, k8zilla.make_yaml(), data=MANIFESTS["hardened"].encode(),
+                                    write=False, analysis=True)
+    assert not result["modified"]
+    assert result["ruamel"] is False
+
+
+def test_fast_loader_leaves_pyyaml_alone():
+    import yaml
+    k8zilla.fast_loader()
+    assert yaml.load("a: yes", Loader=yaml.SafeLoader) == {"a": True}
+    assert yaml.load("a: yes", Loader=k8zilla.fast_loader()) == {"a": "yes"}
+
+
+@pytest.mark.parametrize("switch", ["vault_command", "remove_rootaszero"])
+@pytest.mark.parametrize("writer", ["patch", "dump"])
+@pytest.mark.parametrize("analysis", [True, False])
+def test_containers_without_a_change_are_left_alone(switch, writer, analysis):
+    # neither switch finds anything to do in a bare nginx container, and no
+    # empty securityContext is added on their behalf
+    rules = k8zilla.compile_rules({switch: "on"}, [])
+    text = MANIFESTS["bare"].replace("vault:1", "nginx")
+    result = k8zilla.transform_file("deployment.yaml", rules, k8zilla.make_yaml(), writer=writer,
+                                    data=text.encode(), write=False, analysis=analysis)
+    assert not result["modified"]
+
+
+@pytest.mark.parametrize("writer", ["patch", "dump"])
+def test_single_container_switch(writer):
+    rules = k8zilla.compile_rules({"vault_command": "on"}, [])
+    result = k8zilla.transform_file("deployment.yaml", rules, k8zilla.make_yaml(), writer=writer,
+                                    data=MANIFESTS["bare"].encode(), write=False)
+    assert result["modified"]
+    assert b"command:" in result["output"]
+    assert b"securityContext" not in result["output"]
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import k8zilla
+from conftest import CONFIG_MAP, HARDENED, remote_branches
+
+
+def audit(config):
+    os.chdir(os.path.dirname(config))
+    with pytest.raises(SystemExit) as exited:
+        k8zilla.main(["--config", config, "audit"])
+        exit(0)
+    return exited.value.code
+
+
+def test_pending_changes_exit_2(make_remote, project, capsys):
+    url = make_remote("app")
+    assert audit(project([url, make_remote("done", {"k8s/done.yaml": HARDENED})])) == 2
+    assert "Pending changes: ['app']" in capsys.readouterr().out
+    assert remote_branches(url) == ["main"]
+
+
+def test_nothing_to_change_exits_0(make_remote, project):
+    assert audit(project([make_remote("done", {"k8s/done.yaml": HARDENED, "k8s/cm.yaml": CONFIG_MAP})])) == 0
+
+
+def test_unreachable_repo_exits_1(make_remote, project, tmp_path):
+    assert audit(project([make_remote("app"), (tmp_path / "remotes" / "gone.git").as_uri()])) == 1
+
+
+def test_audit_leaves_the_transform_cache_alone(make_remote, project, tmp_path):
+    cache = tmp_path / "transform_cache"
+    (cache / "ab").mkdir(parents=True)
+    (cache / "ab" / "entry").write_bytes(b"N{}\n")
+    config = project([make_remote("app")],
+                     transform_cache={"enabled": "on", "clear": "on", "path": str(cache)})
+    assert audit(config) == 2
+    assert (cache / "ab" / "entry").exists()
+    assert os.listdir(cache) == ["ab"]
@@ -0,0 +1,112 @@
+import pytest
+
+import k8zilla
+from conftest import CRONJOB, git, remote_branches, remote_file, remote_git
+
+
+@pytest.fixture(params=["gitpython", "pygit2"])
+def backend(request):
+    if request.param == "pygit2":
+        pytest.importorskip("pygit2")
+    return k8zilla.make_git_backend(request.param)
+
+
+def clone(backend, url, strategy="full"):
+    return k8zilla.clone_repo(url, "x", "main", {"strategy": strategy}, backend=backend)
+
+
+def test_clone_checks_out_source_branch(backend, make_remote, workdir):
+    url = make_remote("app")
+    assert clone(backend, url) == "app"
+    assert (workdir / "app" / "k8s" / "cron.yaml").read_text() == CRONJOB
+    assert git("rev-parse", "--abbrev-ref", "HEAD", cwd=workdir / "app").strip() == "main"
+
+
+@pytest.mark.parametrize("strategy", ["shallow", "blobless", "sparse"])
+def test_partial_clones(make_remote, workdir, strategy):
+    # libgit2 has no shallow or partial clones over file://, so GitPython only
+    url = make_remote("app")
+    clone(k8zilla.GitPythonBackend(), url, strategy)
+    assert (workdir / "app" / "k8s" / "cron.yaml").read_text() == CRONJOB
+    if strategy == "sparse":
+        assert not (workdir / "app" / "README.md").exists()
+
+
+def test_unknown_strategy_for_pygit2(make_remote, workdir):
+    pytest.importorskip("pygit2")
+    with pytest.raises(ValueError):
+        clone(k8zilla.Pygit2Backend(), make_remote("app"), "sparse")
+
+
+def test_commit_and_push(backend, make_remote, workdir):
+    url = make_remote("app")
+    clone(backend, url)
+    (workdir / "app" / "k8s" / "cm.yaml").write_text("changed\n")
+    (workdir / "app" / "k8s" / "new.yaml").write_text("new\n")
+    assert backend.remote_has_branch("app", "fix_automata") is False
+    commit, reason = k8zilla.create_branch_and_commit("app", "fix_automata", backend=backend, url=url)
+    assert reason is None
+    assert remote_git(url, "rev-parse", "fix_automata").strip() == commit
+    assert remote_file(url, "fix_automata", "k8s/cm.yaml") == "changed\n"
+    assert remote_file(url, "fix_automata", "k8s/new.yaml") == "new\n"
+    assert remote_file(url, "fix_automata", "README.md") == "hi\n"
+    assert backend.remote_has_branch("app", "fix_automata") is True
+
+
+def test_existing_branch_is_skipped(backend, make_remote, workdir):
+    url = make_remote("app")
+    remote_git(url, "branch", "fix_automata", "main")
+    clone(backend, url)
+    (workdir / "app" / "README.md").write_text("changed\n")
+    commit, reason = k8zilla.create_branch_and_commit("app", "fix_automata", backend=backend, url=url)
+    assert commit is None
+    assert reason == "fix_automata branch already exists in remote for app"
+
+
+def test_push_does_not_overwrite_a_branch_created_meanwhile(backend, make_remote, workdir):
+    # without the remote check the empty lease still refuses the push
+    url = make_remote("app")
+    clone(backend, url)
+    remote_git(url, "branch", "fix_automata", "main")
+    (workdir / "app" / "README.md").write_text("changed\n")
+    commit, reason = k8zilla.create_branch_and_commit("app", "fix_automata", check_remote=False, backend=backend,
+                                                      url=url)
+    assert commit is None
+    assert reason.startswith("An error occurred")
+    assert remote_file(url, "fix_automata", "README.md") == "hi\n"
+
+
+@pytest.mark.parametrize("strategy", ["full", "bare"])
+def test_commit_with_plumbing(backend, make_remote, workdir, strategy):
+    if strategy == "bare" and isinstance(backend, k8zilla.Pygit2Backend):
+        pytest.skip("libgit2 has no shallow clones over file://")
+    url = make_remote("app")
+    clone(backend, url, strategy)
+    changes = {"k8s/cm.yaml": b"changed\n", "k8s/deep/new.yaml": b"new\n", "top.yaml": b"top\n"}
+    commit, reason = k8zilla.commit_with_plumbing("app", "main", "fix_automata", changes, backend=backend,
+                                                  url=url)
+    assert reason is None
+    assert remote_file(url, "fix_automata", "k8s/cm.yaml") == "changed\n"
+    assert remote_file(url, "fix_automata", "k8s/deep/new.yaml") == "new\n"
+    assert remote_file(url, "fix_automata", "top.yaml") == "top\n"
+    assert remote_file(url, "fix_automata", "k8s/cron.yaml") == CRONJOB
+    assert remote_git(url, "rev-parse", "fix_automata^") == remote_git(url, "rev-parse", "main")
+    assert remote_git(url, "fsck", "--strict") == ""
+    if strategy == "full":
+        # the working tree and the checked out branch are left alone
+        assert (workdir / "app" / "k8s" / "cm.yaml").read_text() != "changed\n"
+        assert git("rev-parse", "--abbrev-ref", "HEAD", cwd=workdir / "app").strip() == "main"
+    assert remote_branches(url) == ["fix_automata", "main"]
+
+
+def test_read_blobs(backend, make_remote, workdir):
+    url = make_remote("app")
+    clone(backend, url)
+    blobs = dict(backend.read_blobs("app", "main", k8zilla.manifest_matcher()))
+    assert sorted(blobs) == ["k8s/cm.yaml", "k8s/cron.yaml", "k8s/hardened.yaml"]
+    assert blobs["k8s/cron.yaml"] == CRONJOB.encode()
+
+
+def test_missing_repo_raises_a_git_error(backend, tmp_path, workdir):
+    with pytest.raises(k8zilla.git_errors()):
+        clone(backend, (tmp_path / "missing.git").as_uri())
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import k8zilla_bench
+from conftest import git
+
+PARAMS = {"repos": 2, "files": 6, "multi_document_ratio": 0.3, "max_documents": 3, "configmap_ratio": 0.2,
+          "configmap_kb": 1, "hardened_ratio": 0.3, "seed": 7}
+
+
+def trees(remotes):
+    return [git("--git-dir", remote, "rev-parse", "main^{tree}") for remote in remotes]
+
+
+def test_fleet_is_reproducible_and_reused(tmp_path):
+    remotes = k8zilla_bench.generate_fleet(str(tmp_path / "a"), PARAMS)
+    assert len(remotes) == 2
+    generated = trees(remotes)
+    assert trees(k8zilla_bench.generate_fleet(str(tmp_path / "b"), PARAMS)) == generated
+    marker = tmp_path / "a" / "remotes" / "marker"
+    marker.write_text("")
+    k8zilla_bench.generate_fleet(str(tmp_path / "a"), PARAMS)
+    assert marker.exists()
+    # other parameters give another fleet
+    assert trees(k8zilla_bench.generate_fleet(str(tmp_path / "a"), dict(PARAMS, seed=8))) != generated
+    assert not marker.exists()
+
+
+def bench(tmp_path, *args):
+    argv = ["--repos", "2", "--files", "6", "--configmap-kb", "1", "--repeat", "2",
+            "--fleet-dir", str(tmp_path / "fleet"), *args]
+    k8zilla_bench.main(argv)
+
+
+def test_results_and_comparison(tmp_path, capsys):
+    bench(tmp_path, "--output", str(tmp_path / "before.json"))
+    results = json.loads((tmp_path / "before.json").read_text())
+    assert len(results["runs"]) == 2
+    assert set(results["median"]) == set(k8zilla_bench.PHASES) | {"wall_seconds"}
+    assert all(run["files"] == 12 and 0 < run["modified_files"] < 12 for run in results["runs"])
+    capsys.readouterr()
+    bench(tmp_path, "--output", str(tmp_path / "after.json"), "--compare", str(tmp_path / "before.json"))
+    out = capsys.readouterr().out
+    assert "baseline s" in out and "wall_seconds" in out
+    assert "different parameters" not in out
+
+
+def test_parity(tmp_path, capsys):
+    bench(tmp_path, "--parity")
+    assert "Fleet of 2 repos ready" in capsys.readouterr().out
+
+
+def test_bare_clones_are_refused(tmp_path):
+    with pytest.raises(SystemExit):
+        bench(tmp_path, "--clone", "bare")
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import pytest
+
+import k8zilla
+from conftest import APP_FILES, CONFIG_MAP, CRONJOB, git, remote_git, run
+
+
+@pytest.mark.parametrize("strategy", ["full", "shallow", "blobless", "sparse"])
+def test_clone_strategies_push_the_same_files(make_remote, project, strategy):
+    url = make_remote("app", dict(APP_FILES, **{"docs/big.bin": "x" * 4096}))
+    records = run(project([url], clone={"strategy": strategy}))
+    assert [change["path"] for change in records["app"]["files"]] == ["k8s/cron.yaml"]
+    # sparse clones leave the other paths out of the checkout, never out of the commit
+    assert remote_git(url, "diff", "--name-only", "main", "fix_automata").split() == ["k8s/cron.yaml"]
+
+
+def test_repo_clone_block_overrides_the_global_one(make_remote, project):
+    sparse, full = make_remote("app-1"), make_remote("app-2")
+    repos = [{"url": sparse, "clone": {"strategy": "sparse", "sparse_paths": ["docs/*.yaml"]}}, {"url": full}]
+    records = run(project([], repos=repos, clone={"strategy": "shallow"}))
+    assert records["app-1"]["outcome"] == "not_modified"
+    assert records["app-2"]["outcome"] == "modified"
+
+
+def test_validate_config_rejects_unknown_strategies(project, capsys):
+    config = project(["https://github.com/avles/app.git"], clone={"strategy": "deep"},
+                     repos=[{"url": "https://github.com/avles/app.git", "clone": {"strategy": "thin"}}])
+    with pytest.raises(SystemExit):
+        k8zilla.main(["--config", config, "validate-config"])
+    out = capsys.readouterr().out
+    assert "repos[0] has unknown clone strategy thin" in out
+    assert "unknown clone strategy deep" in out
+
+
+def mirror_of(url, workdir):
+    return Path(k8zilla.mirror_path_for(url, str(workdir / "mirrors")))
+
+
+@pytest.mark.parametrize("strategy", ["full", "sparse"])
+def test_mirror_is_kept_and_fetched_into(make_remote, project, workdir, tmp_path, strategy):
+    url = make_remote("app", {"k8s/cm.yaml": CONFIG_MAP})
+    config = project([url], clone={"strategy": strategy}, mirror_cache={"enabled": "on", "path": "mirrors"})
+    assert run(config)["app"]["outcome"] == "not_modified"
+    mirror = mirror_of(url, workdir)
+    # the plain url is kept for eviction, never the clone url with the PAT in it
+    assert git("config", "k8zilla.url", cwd=mirror).strip() == url
+    # the working copy borrows the mirror's objects instead of copying them
+    assert (workdir / "temp_repos" / "app" / ".git" / "objects" / "info" / "alternates").exists()
+
+    source = tmp_path / "sources" / "app"
+    (source / "k8s" / "cron.yaml").write_text(CRONJOB)
+    git("add", "-A", cwd=source)
+    git("commit", "-qm", "cron", cwd=source)
+    git("push", "-q", url, "main", cwd=source)
+    records = run(config)
+    assert [change["path"] for change in records["app"]["files"]] == ["k8s/cron.yaml"]
+    assert remote_git(url, "diff", "--name-only", "main", "fix_automata").split() == ["k8s/cron.yaml"]
+
+
+def test_mirrors_are_evicted(make_remote, project, workdir):
+    kept, dropped = make_remote("app-1"), make_remote("app-2")
+    mirror_cache = {"enabled": "on", "path": "mirrors"}
+    run(project([kept, dropped], mirror_cache=mirror_cache))
+    assert mirror_of(dropped, workdir).exists()
+    remote_git(kept, "branch", "-D", "fix_automata")
+    run(project([kept], mirror_cache=mirror_cache))
+    assert mirror_of(kept, workdir).exists()
+    assert not mirror_of(dropped, workdir).exists()
+    # over max_size_mb, least recently used first, down to nothing here
+    remote_git(kept, "branch", "-D", "fix_automata")
+    run(project([kept], mirror_cache=dict(mirror_cache, max_size_mb=0)))
+    assert list((workdir / "mirrors").iterdir()) == []
@@ -0,0 +1,93 @@
+import json
+import socket
+import threading
+import time
+from http import client as http_client
+from pathlib import Path
+
+import pytest
+
+import k8zilla
+from conftest import PATHWAY, SWITCHES
+
+
+def wait_for(path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not Path(path).exists():
+        assert time.monotonic() < deadline, f"{path} never appeared"
+        time.sleep(0.05)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def start_daemon(workdir, tmp_path):
+    # starts run_daemon in a thread; start.stop() or the teardown stops it
+    # and waits for it to finish
+    threads = []
+    stop = threading.Event()
+
+    def stop_daemons():
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    def start(**daemon):
+        project_data = {"switches": SWITCHES, "api_migration_pathway": PATHWAY, "target_branch": "fix_automata",
+                        "mirror_cache": {"enabled": "on", "path": str(tmp_path / "mirrors"), "max_size_mb": 100}}
+        settings = k8zilla.load_settings(project_data)
+        daemon = dict({"spool": str(workdir / "spool"), "workers": 1, "poll_seconds": 0.05}, **daemon)
+        thread = threading.Thread(target=k8zilla.run_daemon, args=("x", settings, daemon, stop))
+        thread.start()
+        threads.append(thread)
+        wait_for(Path(daemon["spool"], "incoming"))
+        return daemon["spool"]
+    start.stop = stop_daemons
+    yield start
+    stop_daemons()
+
+
+def finished(spool, name, state="done"):
+    wait_for(Path(spool, state, name))
+    return json.loads(Path(spool, state, name).read_text())
+
+
+def test_spooled_job_is_hardened_and_the_mirror_kept(start_daemon, make_remote, tmp_path):
+    url = make_remote("app")
+    spool = start_daemon()
+    assert finished(spool, k8zilla.enqueue_job(spool, {"url": url}))["record"]["outcome"] == "modified"
+    start_daemon.stop()
+    mirrors = [path.name for path in (tmp_path / "mirrors").iterdir()]
+    assert mirrors == [Path(k8zilla.mirror_path_for(url, str(tmp_path / "mirrors"))).name]
+
+
+def test_unreadable_job_fails(start_daemon):
+    spool = start_daemon()
+    Path(spool, "incoming", "bad.json").write_text("{not json")
+    assert finished(spool, "bad.json", "failed")["error"].startswith("unreadable job")
+
+
+def test_jobs_left_in_processing_are_retried(make_remote, start_daemon, workdir):
+    url = make_remote("app")
+    Path(workdir, "spool", "processing").mkdir(parents=True)
+    Path(workdir, "spool", "processing", "left.json").write_text(json.dumps({"url": url}))
+    spool = start_daemon()
+    assert finished(spool, "left.json")["record"]["outcome"] == "modified"
+
+
+def test_jobs_can_be_posted(make_remote, start_daemon):
+    url = make_remote("app")
+    port = free_port()
+    spool = start_daemon(http_port=port)
+    connection = http_client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("POST", "/jobs", json.dumps({"name": "no url"}))
+    assert connection.getresponse().status == 400
+    connection = http_client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("POST", "/jobs", json.dumps({"url": url}))
+    response = connection.getresponse()
+    assert response.status == 202
+    assert finished(spool, json.loads(response.read())["job"])["record"]["outcome"] == "modified"
@@ -0,0 +1,49 @@
+import pytest
+
+import k8zilla
+from conftest import CONFIG_MAP, CRONJOB, git, run
+
+
+@pytest.mark.parametrize("discovery, path, expected", [
+    (None, "k8s/app.yaml", True),
+    (None, "app.yml", True),
+    (None, "README.md", False),
+    (None, "k8s/app.yaml.bak", False),
+    ({"include": ["deploy/*.yaml"]}, "deploy/overlays/prod/app.yaml", True),
+    ({"include": ["deploy/*.yaml"]}, "k8s/app.yaml", False),
+    ({"exclude": ["node_modules/*"]}, "node_modules/pkg/chart.yaml", False),
+    ({"exclude": ["node_modules/*"]}, "k8s/node_modules.yaml", True),
+])
+def test_manifest_matcher(discovery, path, expected):
+    assert k8zilla.manifest_matcher(discovery)(path) is expected
+
+
+def test_discover_manifests(tmp_path):
+    files = {"k8s/app.yaml": CRONJOB, "k8s/cm.yml": CONFIG_MAP, "README.md": "hi\n",
+             "node_modules/pkg/chart.yaml": CONFIG_MAP, ".gitignore": "build/\n"}
+    for path, text in files.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(text)
+    git("init", "-q", cwd=tmp_path)
+    git("add", "-A", cwd=tmp_path)
+    # untracked files are picked up unless .gitignore excludes them
+    (tmp_path / "new.yaml").write_text(CONFIG_MAP)
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "out.yaml").write_text(CONFIG_MAP)
+
+    def found(discovery=None):
+        return sorted(path[len(str(tmp_path)) + 1:] for path in k8zilla.discover_manifests(str(tmp_path), discovery))
+    assert found() == ["k8s/app.yaml", "k8s/cm.yml", "new.yaml", "node_modules/pkg/chart.yaml"]
+    assert found({"exclude": ["node_modules/*"]}) == ["k8s/app.yaml", "k8s/cm.yml", "new.yaml"]
+    assert found({"include": ["k8s/*"]}) == ["k8s/app.yaml", "k8s/cm.yml"]
+
+
+@pytest.mark.parametrize("mode", ["worktree", "plumbing"])
+def test_run_uses_the_discovery_blocks(make_remote, project, mode):
+    files = {"k8s/cron.yml": CRONJOB, "vendor/cron.yaml": CRONJOB}
+    excluded, overridden = make_remote("app-1", files), make_remote("app-2", files)
+    repos = [{"url": excluded}, {"url": overridden, "discovery": {"exclude": ["k8s/*"]}}]
+    records = run(project([], repos=repos, commit={"mode": mode}, discovery={"exclude": ["vendor/*"]}))
+    assert [change["path"] for change in records["app-1"]["files"]] == ["k8s/cron.yml"]
+    # a repo's own block replaces the keys it sets
+    assert [change["path"] for change in records["app-2"]["files"]] == ["vendor/cron.yaml"]
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import k8zilla
+from conftest import CONFIG_MAP, run
+
+
+class StandIn(BaseHTTPRequestHandler):
+    # the two pulls endpoints of the GitHub API; the first POST gets a 429
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=None, headers=()):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def counted(handler):
+        def wrapper(self):
+            server = self.server
+            with server.lock:
+                server.stats["in_flight"] += 1
+                server.stats["max_in_flight"] = max(server.stats["max_in_flight"], server.stats["in_flight"])
+            try:
+                time.sleep(0.02)
+                handler(self)
+            finally:
+                with server.lock:
+                    server.stats["in_flight"] -= 1
+        return wrapper
+
+    @counted
+    def do_GET(self):
+        server = self.server
+        repo = self.path.split("?")[0].rsplit("/pulls", 1)[0]
+        with server.lock:
+            body = list(server.pulls.get(repo, []))
+        etag = '"' + hashlib.sha1(json.dumps(body).encode()).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            with server.lock:
+                server.stats["not_modified"] += 1
+            return self.reply(304, headers=[("ETag", etag)])
+        self.reply(200, body, [("ETag", etag)])
+
+    @counted
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        assert self.headers["Authorization"] == "Bearer x"
+        repo = self.path.rsplit("/pulls", 1)[0]
+        with server.lock:
+            server.stats["posts"] += 1
+            if server.stats["posts"] == 1:
+                return self.reply(429, {"message": "slow down"}, [("Retry-After", "0")])
+            pull = dict(request, html_url=f"https://github.test{repo}/pull/1")
+            server.pulls.setdefault(repo, []).append(pull)
+        self.reply(201, pull)
+
+
+@pytest.fixture
+def github():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.lock = threading.Lock()
+    server.pulls = {}
+    server.stats = {"in_flight": 0, "max_in_flight": 0, "not_modified": 0, "posts": 0}
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def records(count):
+    changes = [{"path": "k8s/cron.yaml", "rules": {"nonroot": 1, "upgrade_apis": 1}}]
+    return [k8zilla.repo_record(index, f"https://github.com/avles/k8-app-{index}.git", "modified", changes=changes)
+            for index in range(count)]
+
+
+def settings(api_url, **pull_requests):
+    return {"source_branch": "main", "target_branch": "fix_automata",
+            "pull_requests": dict(pull_requests, enabled="on", api_url=api_url)}
+
+
+def test_opens_pull_requests(github):
+    outcomes = k8zilla.open_pull_requests(records(3), "x", settings(github.url))
+    assert outcomes == {f"https://github.com/avles/k8-app-{index}.git":
+                        ("opened", f"https://github.test/repos/avles/k8-app-{index}/pull/1") for index in range(3)}
+    pull = github.pulls["/repos/avles/k8-app-0"][0]
+    assert pull["head"] == "fix_automata" and pull["base"] == "main"
+    assert "- `nonroot`: 1 change(s)" in pull["body"]
+    assert "- `k8s/cron.yaml`" in pull["body"]
+
+
+def test_rate_limited_request_is_retried(github):
+    outcomes = k8zilla.open_pull_requests(records(1), "x", settings(github.url, max_retries=1))
+    assert [outcome for outcome, _ in outcomes.values()] == ["opened"]
+    assert github.stats["posts"] == 2
+
+
+def test_max_concurrency(github):
+    k8zilla.open_pull_requests(records(4), "x", settings(github.url, max_concurrency=1))
+    assert github.stats["max_in_flight"] == 1
+
+
+def test_open_pull_requests_are_reused_and_revalidated(github, tmp_path):
+    config = settings(github.url, etag_cache=str(tmp_path / "etags.json"))
+    assert {outcome for outcome, _ in k8zilla.open_pull_requests(records(2), "x", config).values()} == {"opened"}
+    posts = github.stats["posts"]
+    assert {outcome for outcome, _ in k8zilla.open_pull_requests(records(2), "x", config).values()} == {"exists"}
+    assert github.stats["not_modified"] == 0
+    # the listings did not change since the second run saved their ETags
+    assert {outcome for outcome, _ in k8zilla.open_pull_requests(records(2), "x", config).values()} == {"exists"}
+    assert github.stats["not_modified"] == 2
+    assert github.stats["posts"] == posts
+
+
+def test_unreachable_api_fails_the_repos():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    outcomes = k8zilla.open_pull_requests(records(2), "x", settings(f"http://127.0.0.1:{port}", max_retries=0))
+    assert {outcome for outcome, _ in outcomes.values()} == {"failed"}
+
+
+def test_run_opens_pull_requests_for_pushed_repos(github, make_remote, project, capsys):
+    pushed, untouched = make_remote("app-1"), make_remote("app-2", {"k8s/cm.yaml": CONFIG_MAP})
+    config = project([pushed, untouched], pull_requests={"enabled": "on", "api_url": github.url})
+    run(config)
+    assert "Pull requests opened: ['app-1'], already open: [], failed: []" in capsys.readouterr().out
+    # the pulls path comes from the url, which for a local remote ends in remotes/app-1
+    assert list(github.pulls) == ["/repos/remotes/app-1"]
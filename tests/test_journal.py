@@ -0,0 +1,73 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import k8zilla
+from conftest import PATHWAY, SWITCHES, git, remote_git, run
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resume_after_an_interrupted_transform(make_remote, project, workdir):
+    # the files were already rewritten when the run stopped, the journal
+    # only got as far as the clone
+    url = make_remote("app")
+    config = project([url])
+    git("clone", "-q", url, str(workdir / "temp_repos" / "app"))
+    rules = k8zilla.compile_rules(SWITCHES, PATHWAY)
+    for path in (workdir / "temp_repos" / "app" / "k8s").glob("*.yaml"):
+        k8zilla.transform_file(str(path), rules)
+    journal = [{"source_branch": "main", "target_branch": "fix_automata", "phase": "started"},
+               {"url": url, "phase": "cloned"}]
+    Path(workdir / "k8zilla-journal.jsonl").write_text("".join(json.dumps(entry) + "\n" for entry in journal))
+    records = run(config, "--resume")
+    assert records["app"]["outcome"] == "modified"
+    assert remote_git(url, "diff", "--name-only", "main", "fix_automata").split() == ["k8s/cron.yaml"]
+
+
+def test_resume_after_an_interrupted_commit(make_remote, project, monkeypatch):
+    # stopped after `checkout -b` and `add -A`, before the commit was journaled
+    url = make_remote("app")
+    config = project([url])
+
+    def commit_all(self, repo_name, message):
+        git("add", "-A", cwd=repo_name)
+        raise Interrupted()
+    with monkeypatch.context() as patched:
+        patched.setattr(k8zilla.GitPythonBackend, "commit_all", commit_all)
+        with pytest.raises(Interrupted):
+            run(config)
+    records = run(config, "--resume")
+    assert records["app"]["outcome"] == "modified"
+    assert remote_git(url, "diff", "--name-only", "main", "fix_automata").split() == ["k8s/cron.yaml"]
+
+
+@pytest.mark.parametrize("mode", ["worktree", "plumbing"])
+def test_resume_after_an_interrupted_push(make_remote, project, monkeypatch, mode):
+    url = make_remote("app")
+    config = project([url], commit={"mode": mode})
+
+    def push(self, repo_name, branch):
+        raise Interrupted()
+    with monkeypatch.context() as patched:
+        patched.setattr(k8zilla.GitPythonBackend, "push", push)
+        with pytest.raises(Interrupted):
+            run(config)
+    # a later commit time, so the plumbing commit of the resumed run differs
+    monkeypatch.setenv("GIT_COMMITTER_DATE", "2030-01-01T00:00:00")
+    records = run(config, "--resume")
+    assert records["app"]["outcome"] == "modified"
+    assert remote_git(url, "diff", "--name-only", "main", "fix_automata").split() == ["k8s/cron.yaml"]
+
+
+def test_finished_repos_are_not_run_again(make_remote, project):
+    url = make_remote("app")
+    config = project([url])
+    run(config)
+    remote_git(url, "branch", "-D", "fix_automata")
+    # the report is appended to, so it still holds the first run's record
+    assert list(run(config, "--resume")) == ["app"]
+    assert "fix_automata" not in remote_git(url, "branch")
@@ -0,0 +1,49 @@
+import pytest
+
+import k8zilla
+from conftest import APP_FILES, CONFIG_MAP, HARDENED, PATHWAY, SWITCHES, remote_git, run
+
+
+def prefilter(switches=SWITCHES):
+    return k8zilla.build_prefilter(k8zilla.compile_rules(switches, PATHWAY))
+
+
+@pytest.mark.parametrize("text, expected", [
+    (HARDENED, True),
+    (CONFIG_MAP, False),
+    ('{"apiVersion": "apps/v1", "kind": "StatefulSet"}', True),
+    ("kind: 'Job'\n", True),
+    ("kind: JobTemplate\n", False),
+    # upgrade_apis looks at the apiVersion whatever the kind
+    ("apiVersion: batch/v1beta1\nkind: Thing\n", True),
+    ("apiVersion: batch/v1beta12\nkind: Thing\n", False),
+    ("", False),
+])
+def test_may_need_changes(tmp_path, text, expected):
+    path = tmp_path / "manifest.yaml"
+    path.write_text(text)
+    assert k8zilla.may_need_changes(str(path), prefilter()) is expected
+
+
+def test_only_enabled_rules_are_in_the_prefilter():
+    kinds_only = prefilter({"nonroot": "on"})
+    assert kinds_only.search(b"apiVersion: batch/v1beta1\nkind: Thing\n") is None
+    assert kinds_only.search(b"kind: Deployment\n") is not None
+    assert prefilter({}).search(HARDENED.encode()) is None
+
+
+@pytest.mark.parametrize("mode", ["worktree", "plumbing"])
+def test_run_counts_the_prefiltered_files(make_remote, project, monkeypatch, capsys, mode):
+    files = dict(APP_FILES, **{"k8s/cm-2.yaml": CONFIG_MAP, "k8s/empty.yaml": ""})
+    url = make_remote("app", files)
+    # the counters are per process, not per run
+    monkeypatch.setattr(k8zilla, "run_stats", {"files_seen": 0, "files_prefiltered": 0})
+    filtered = run(project([url], commit={"mode": mode}))
+    assert "Files prefiltered: 3 of 5\n" in capsys.readouterr().out
+
+    monkeypatch.setattr(k8zilla, "run_stats", {"files_seen": 0, "files_prefiltered": 0})
+    remote_git(url, "branch", "-D", "fix_automata")
+    unfiltered = run(project([url], commit={"mode": mode}, transform={"prefilter": "off"}))
+    assert "Files prefiltered: 0 of 5\n" in capsys.readouterr().out
+    assert [change["path"] for change in unfiltered["app"]["files"]] == \
+        [change["path"] for change in filtered["app"]["files"]] == ["k8s/cron.yaml"]
@@ -0,0 +1,27 @@
+import os
+
+from conftest import remote_git, run
+
+
+def test_existing_target_branch_is_skipped_before_cloning(make_remote, project):
+    url = make_remote("app")
+    remote_git(url, "branch", "fix_automata", "main")
+    records = run(project([url], preflight={"enabled": "on"}))
+    assert records["app"]["outcome"] == "skipped"
+    assert records["app"]["reason"] == "fix_automata branch already exists in remote for app"
+    assert not os.path.exists("app")
+
+
+def test_missing_source_branch_is_skipped_before_cloning(make_remote, project):
+    url = make_remote("app")
+    records = run(project([url], preflight={"enabled": "on"}, source_branch="develop"))
+    assert records["app"]["reason"] == "develop branch does not exist in remote for app"
+    assert not os.path.exists("app")
+
+
+def test_without_preflight_the_branch_is_checked_before_the_commit(make_remote, project):
+    url = make_remote("app")
+    remote_git(url, "branch", "fix_automata", "main")
+    records = run(project([url], preflight={"enabled": "off"}))
+    assert records["app"]["outcome"] == "skipped"
+    assert remote_git(url, "rev-parse", "fix_automata") == remote_git(url, "rev-parse", "main")
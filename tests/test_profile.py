@@ -0,0 +1,60 @@
+import json
+import re
+
+import pytest
+
+import k8zilla
+from conftest import CONFIG_MAP, CRONJOB, HARDENED, PATHWAY, SWITCHES, run
+
+METRIC = re.compile(r'^k8zilla_[a-z_]+(\{[a-z]+="[^"]+"\})? [0-9.]+$')
+
+
+@pytest.fixture
+def fresh_profile(monkeypatch):
+    # the profile and the counters are per process, not per run
+    monkeypatch.setattr(k8zilla, "run_stats", {"files_seen": 0, "files_prefiltered": 0})
+    monkeypatch.setattr(k8zilla, "run_profile", {"phases": {}, "rule_hits": {}, "slowest_files": [],
+                                                 "slowest_limit": 20})
+
+
+def test_run_writes_the_profile(fresh_profile, make_remote, project, workdir, capsys):
+    files = {f"k8s/cron-{n}.yaml": CRONJOB for n in range(3)}
+    urls = [make_remote("app-1", files), make_remote("app-2", {"k8s/cm.yaml": CONFIG_MAP})]
+    profile = {"enabled": "on", "path": "profile.json", "prometheus_textfile": "metrics.prom", "slowest_files": 2}
+    run(project(urls, profile=profile))
+    assert "Slowest phases: " in capsys.readouterr().out
+
+    # relative paths are taken from where k8zilla was started
+    written = json.loads((workdir / "profile.json").read_text())
+    assert written["tool_version"] == k8zilla.TOOL_VERSION
+    assert {"clone", "transform", "push"} <= set(written["phases"])
+    assert written["rule_hits"] == {"nonroot": 3, "previlege_escalation": 3, "remove_rootaszero": 3,
+                                    "upgrade_apis": 3, "vault_command": 3}
+    assert written["files"]["files_seen"] == 4
+    slowest = written["slowest_files"]
+    assert len(slowest) == 2
+    assert slowest[0]["seconds"] >= slowest[1]["seconds"]
+    assert {"parse", "rules", "dump"} <= set(slowest[0])
+
+    metrics = (workdir / "metrics.prom").read_text().splitlines()
+    assert all(METRIC.match(line) for line in metrics if not line.startswith("#"))
+    assert 'k8zilla_rule_hits{switch="nonroot"} 3' in metrics
+    assert 'k8zilla_run_stats{stat="files_seen"} 4' in metrics
+    assert f"k8zilla_run_seconds {written['wall_seconds']:.6f}" in metrics
+    assert "# TYPE k8zilla_phase_seconds gauge" in metrics
+
+
+def test_no_profile_unless_enabled(fresh_profile, make_remote, project, workdir, capsys):
+    run(project([make_remote("app")], profile={"path": "profile.json"}))
+    assert "Slowest phases" not in capsys.readouterr().out
+    assert not (workdir / "profile.json").exists()
+
+
+@pytest.mark.parametrize("analysis", [True, False])
+def test_rule_hits_count_only_changes(analysis):
+    # the Deployment is already hardened, whether or not the fast tier skips it
+    rules = k8zilla.compile_rules(SWITCHES, PATHWAY)
+    data = (CRONJOB + "---\n" + HARDENED).encode()
+    result = k8zilla.transform_file("manifest.yaml", rules, data=data, write=False, analysis=analysis)
+    assert result["rules"] == {"nonroot": 1, "previlege_escalation": 1, "remove_rootaszero": 1,
+                               "upgrade_apis": 1, "vault_command": 1}
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+import k8zilla
+from conftest import run
+
+
+@pytest.mark.parametrize("preflight", ["on", "off"])
+def test_unreachable_repo_is_skipped(make_remote, project, tmp_path, preflight):
+    missing = (tmp_path / "remotes" / "gone.git").as_uri()
+    records = run(project([missing, make_remote("app")], preflight={"enabled": preflight}))
+    assert records["gone"]["outcome"] == "skipped"
+    assert records["gone"]["reason"]
+    assert records["app"]["outcome"] == "modified"
+
+
+def test_remote_errors_are_classified():
+    assert k8zilla.is_transient_git_error("fatal: unable to access: Connection reset by peer")
+    assert k8zilla.is_transient_git_error("error: RPC failed; HTTP 503 curl 22 The requested URL returned error: 503")
+    assert not k8zilla.is_transient_git_error("remote: Repository not found.")
+    assert not k8zilla.is_transient_git_error("fatal: Authentication failed for 'https://github.com/a/b.git/'")
+    assert not k8zilla.is_transient_git_error("! [rejected] fix_automata -> fix_automata (stale info)")
+    assert not k8zilla.is_transient_git_error("something else entirely")
+
+
+def test_hosts_are_limited_but_local_remotes_are_not():
+    assert k8zilla.host_for("https://x@github.com/avles/k8-app-1.git") == "github.com"
+    assert k8zilla.host_for("git@gitlab.example.com:avles/k8-app-1.git") == "gitlab.example.com"
+    assert k8zilla.host_for("file:///tmp/app.git") is None
+    assert k8zilla.host_for("/tmp/app.git") is None
+
+
+def test_transient_errors_are_retried(remote_limits):
+    remote_limits.configure({"max_retries": 2, "backoff_seconds": 0, "rate_per_second": 1000})
+    url = "https://github.com/avles/k8-app-1.git"
+    failures = ["Connection reset by peer", "The requested URL returned error: 502"]
+
+    def flaky():
+        if failures:
+            raise k8zilla.GitBackendError(failures.pop(0))
+        return "cloned"
+    assert remote_limits.call(url, "clone", flaky) == "cloned"
+    assert remote_limits.take_retries(url) == {"clone": 2}
+
+    def gone():
+        failures.append(None)
+        raise k8zilla.GitBackendError("remote: Repository not found.")
+    with pytest.raises(k8zilla.GitBackendError):
+        remote_limits.call(url, "clone", gone)
+    assert failures == [None]
+    assert remote_limits.take_retries(url) == {}
+
+
+def test_retries_give_up(remote_limits):
+    remote_limits.configure({"max_retries": 1, "backoff_seconds": 0, "rate_per_second": 1000})
+    url = "https://github.com/avles/k8-app-1.git"
+
+    def down():
+        raise k8zilla.GitBackendError("Could not resolve host: github.com")
+    with pytest.raises(k8zilla.GitBackendError):
+        remote_limits.call(url, "push", down)
+    assert remote_limits.take_retries(url) == {"push": 1}
+
+
+def test_token_bucket_paces_calls():
+    bucket = k8zilla.TokenBucket(rate=50, burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.take()
+    # two from the burst, then one every 20 ms
+    assert time.monotonic() - start >= 0.07
+
+
+def test_push_failure_skips_the_repo(make_remote, project, monkeypatch):
+    url, other = make_remote("app"), make_remote("other")
+
+    def push(self, repo_name, branch):
+        if repo_name == "app":
+            raise k8zilla.GitBackendError("remote: Permission denied")
+        return original(self, repo_name, branch)
+    original = k8zilla.GitPythonBackend.push
+    monkeypatch.setattr(k8zilla.GitPythonBackend, "push", push)
+    records = run(project([url, other]))
+    assert records["app"]["outcome"] == "skipped"
+    assert "Permission denied" in records["app"]["reason"]
+    assert records["other"]["outcome"] == "modified"
+
+
+def test_max_concurrent_per_host(remote_limits):
+    remote_limits.configure({"max_concurrent": 2, "rate_per_second": 1000, "burst": 10})
+    lock = threading.Lock()
+    running = [0, 0]  # now, most at once
+
+    def clone():
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+    threads = [threading.Thread(target=remote_limits.call, args=(f"https://github.com/a/{i}.git", "clone", clone))
+               for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert running[1] == 2
@@ -0,0 +1,23 @@
+import json
+
+import k8zilla
+
+
+def record(index, repo, outcome, files=()):
+    changes = [{"path": path, "rules": {"nonroot": 1}, "timings": {"parse": 0.1}, "cache": None} for path in files]
+    return k8zilla.repo_record(index, f"file:///remotes/{repo}.git", outcome, changes=changes)
+
+
+def test_summary_keeps_the_last_record_of_each_repo(tmp_path):
+    path = tmp_path / "report.jsonl"
+    records = [record(1, "b", "modified", ["k8s/b.yaml"]), record(0, "a", "skipped"),
+               record(2, "c", "modified", ["k8s/c.yaml"]),
+               # a resumed run reported these two again
+               record(0, "a", "modified", ["k8s/a.yaml", "k8s/a2.yaml"]), record(2, "c", "not_modified")]
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in records))
+    report, pushed = k8zilla.summarize_run_report(str(path))
+    assert report == {"modified": ["a", "b"], "not_modified": ["c"], "skipped": []}
+    assert [entry["repo"] for entry in pushed] == ["a", "b"]
+    assert pushed[0] == {"index": 0, "repo": "a", "url": "file:///remotes/a.git", "rule_changes": {"nonroot": 2},
+                         "files_changed": 2, "files": [{"path": "k8s/a.yaml"}, {"path": "k8s/a2.yaml"}]}
+    assert "- `k8s/a2.yaml`" in k8zilla.pull_request_body(pushed[0])
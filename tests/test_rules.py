@@ -0,0 +1,131 @@
+import pytest
+
+import k8zilla
+from conftest import CONFIG_MAP, CRONJOB, PATHWAY, SWITCHES
+
+
+ROLLOUT = """apiVersion: argoproj.io/v1alpha1
+kind: Rollout
+metadata:
+  name: r
+spec:
+  template:
+    spec:
+      initContainers:
+        - name: init
+          image: busybox
+      containers:
+        - name: a
+          image: nginx
+"""
+CLONE_SET = ROLLOUT.replace("argoproj.io/v1alpha1", "apps.kruise.io/v1alpha1").replace("Rollout", "CloneSet")
+CLONE_SET_SPEC = {"api_version": "apps.kruise.io/v1alpha1", "kind": "CloneSet", "path": "spec.template.spec"}
+
+
+def hop(from_api_version, to_api_version, kind=None, strategy="native"):
+    entry = {"from_api_version": from_api_version, "to_api_version": to_api_version, "strategy": strategy}
+    if kind is not None:
+        entry["kind"] = kind
+    return entry
+
+
+def upgraded(pathway, api_version, kind):
+    rules = k8zilla.compile_rules({"upgrade_apis": "on"}, pathway)
+    document = {"apiVersion": api_version, "kind": kind, "metadata": {"name": "x"}}
+    k8zilla.apply_rules([document], rules)
+    return document["apiVersion"]
+
+
+def test_chains_are_followed_to_the_end():
+    pathway = [hop("a/v1beta1", "a/v1"), hop("a/v1alpha1", "a/v1beta1")]
+    assert k8zilla.compile_api_migrations(pathway) == {("a/v1alpha1", None): ("a/v1", "native"),
+                                                       ("a/v1beta1", None): ("a/v1", "native")}
+    assert upgraded(pathway, "a/v1alpha1", "Anything") == "a/v1"
+
+
+def test_chains_continue_into_hops_for_one_kind():
+    pathway = [hop("a/v1alpha1", "a/v1beta1"), hop("a/v1beta1", "a/v1", kind="cronjob")]
+    assert upgraded(pathway, "a/v1alpha1", "CronJob") == "a/v1"
+    assert upgraded(pathway, "a/v1alpha1", "Job") == "a/v1beta1"
+    assert upgraded(pathway, "a/v1beta1", "Job") == "a/v1beta1"
+
+
+def test_hops_only_apply_to_their_kind():
+    pathway = [hop("batch/v1beta1", "batch/v1", kind="CronJob")]
+    assert upgraded(pathway, "batch/v1beta1", "CronJob") == "batch/v1"
+    assert upgraded(pathway, "batch/v1beta1", "cronjob") == "batch/v1"
+    assert upgraded(pathway, "batch/v1beta1", "Job") == "batch/v1beta1"
+
+
+def test_a_kind_hop_wins_over_the_generic_one():
+    pathway = [hop("a/v1beta1", "a/v1"), hop("a/v1beta1", "a/v2", kind="cronjob")]
+    assert upgraded(pathway, "a/v1beta1", "CronJob") == "a/v2"
+    assert upgraded(pathway, "a/v1beta1", "Job") == "a/v1"
+
+
+def test_kubectl_convert_anywhere_in_the_chain_is_kept():
+    pathway = [hop("a/v1alpha1", "a/v1beta1", strategy="kubectl_convert"), hop("a/v1beta1", "a/v1")]
+    assert k8zilla.compile_api_migrations(pathway)[("a/v1alpha1", None)] == ("a/v1", "kubectl_convert")
+
+
+@pytest.mark.parametrize("pathway", [
+    [hop("a/v1", "a/v2"), hop("a/v2", "a/v1")],
+    [hop("a/v1", "a/v2"), hop("a/v2", "a/v1", kind="cronjob")],
+])
+def test_cycles_are_rejected(pathway):
+    with pytest.raises(ValueError):
+        k8zilla.compile_api_migrations(pathway)
+
+
+def harden(text, pod_specs=()):
+    rules = k8zilla.compile_rules(SWITCHES, PATHWAY, pod_specs)
+    result = k8zilla.transform_file("manifest.yaml", rules, k8zilla.make_yaml(), data=text.encode(), write=False)
+    return result["output"].decode() if result["modified"] else None
+
+
+def test_rollout_containers_are_hardened():
+    assert harden(ROLLOUT).count("runAsNonRoot: true") == 2
+
+
+def test_custom_resources_need_a_pod_spec_entry():
+    assert harden(CLONE_SET) is None
+    assert harden(CLONE_SET, [CLONE_SET_SPEC]).count("allowPrivilegeEscalation: false") == 2
+    # the entry is for one apiVersion only
+    assert harden(CLONE_SET.replace("v1alpha1", "v1beta1"), [CLONE_SET_SPEC]) is None
+    assert harden(CLONE_SET.replace("v1alpha1", "v1beta1"), [dict(CLONE_SET_SPEC, api_version=None)])
+
+
+def test_pod_spec_entries_replace_built_in_paths():
+    pod_specs = [{"kind": "Deployment", "path": ["spec", "podSpec"]}]
+    moved = "apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: d\nspec:\n  podSpec:\n" \
+            "    containers:\n      - name: a\n        image: nginx\n"
+    assert "runAsNonRoot: true" in harden(moved, pod_specs)
+    assert harden(moved) is None
+
+
+def test_documents_without_a_pod_spec_are_skipped():
+    assert harden("apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: d\nspec: {}\n") is None
+    assert harden("apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: d\nspec:\n  template: []\n") is None
+
+
+@pytest.mark.parametrize("switch", sorted(SWITCHES))
+def test_only_enabled_switches_run(switch):
+    rules = k8zilla.compile_rules({switch: "on"}, PATHWAY)
+    result = k8zilla.transform_file("manifest.yaml", rules, k8zilla.make_yaml(), data=CRONJOB.encode(), write=False)
+    assert result["rules"] == {switch: 1}
+
+
+def test_registered_rules_run_for_their_kinds(monkeypatch):
+    monkeypatch.setattr(k8zilla, "RULES", list(k8zilla.RULES))
+
+    @k8zilla.hardening_rule("label_config_maps", kinds=["ConfigMap"])
+    def label_config_maps(content, edits, options):
+        k8zilla.set_key(content["metadata"], "labels", {"hardened": "k8zilla"}, edits)
+        return True
+    rules = k8zilla.compile_rules({"label_config_maps": "on"}, [])
+    assert set(rules["by_kind"]) == {"ConfigMap"}
+    config_map = k8zilla.transform_file("cm.yaml", rules, k8zilla.make_yaml(), data=CONFIG_MAP.encode(), write=False)
+    assert "labels:\n    hardened: k8zilla\n" in config_map["output"].decode()
+    assert not k8zilla.transform_file("cron.yaml", rules, k8zilla.make_yaml(), data=CRONJOB.encode(),
+                                      write=False)["modified"]
+    assert k8zilla.build_prefilter(rules).search(b"kind: ConfigMap") is not None
@@ -0,0 +1,93 @@
+import pytest
+
+from conftest import APP_FILES, CONFIG_MAP, CRONJOB, HARDENED, git, remote_file, remote_git, run
+
+
+def test_run_hardens_and_pushes(make_remote, project):
+    hardening, untouched = make_remote("app-1"), make_remote("app-2", {"k8s/cm.yaml": CONFIG_MAP})
+    records = run(project([hardening, untouched], preflight={"enabled": "on"}))
+    assert records["app-1"]["outcome"] == "modified"
+    assert records["app-2"]["outcome"] == "not_modified"
+    assert [change["path"] for change in records["app-1"]["files"]] == ["k8s/cron.yaml"]
+    assert records["app-1"]["rule_changes"] == {"nonroot": 1, "previlege_escalation": 1, "remove_rootaszero": 1,
+                                                "upgrade_apis": 1, "vault_command": 1}
+    cron = remote_file(hardening, "fix_automata", "k8s/cron.yaml")
+    assert "apiVersion: batch/v1\n" in cron
+    assert "name: c  # keep me\n" in cron
+    assert "runAsUser" not in cron
+    assert remote_file(hardening, "fix_automata", "k8s/hardened.yaml") == HARDENED
+
+
+@pytest.mark.parametrize("backend", ["gitpython", "pygit2"])
+@pytest.mark.parametrize("mode", ["worktree", "plumbing"])
+def test_backends_and_commit_modes_push_the_same_files(make_remote, project, backend, mode):
+    if backend == "pygit2":
+        pytest.importorskip("pygit2")
+    url = make_remote("app")
+    records = run(project([url], git_backend=backend, commit={"mode": mode}))
+    assert records["app"]["outcome"] == "modified"
+    assert remote_git(url, "diff", "--name-only", "main", "fix_automata").split() == ["k8s/cron.yaml"]
+
+
+def fleet(make_remote):
+    return [make_remote(f"app-{n}", files) for n, files in
+            enumerate([APP_FILES, {"k8s/cm.yaml": CONFIG_MAP}, APP_FILES, {"k8s/done.yaml": HARDENED}, APP_FILES])]
+
+
+def outcomes(records):
+    return {repo: (record["outcome"], [change["path"] for change in record["files"]])
+            for repo, record in records.items()}
+
+
+def repo_lists(out):
+    return out.split("Report:\n")[1].splitlines()[:3]
+
+
+def test_pipeline_matches_the_sequential_run(make_remote, project, tmp_path, capsys):
+    urls = fleet(make_remote)
+    urls.insert(2, (tmp_path / "remotes" / "gone.git").as_uri())
+    # queue_size 1 keeps every queue full while the stages shut down
+    pipeline = {"enabled": "on", "clone_workers": 3, "transform_workers": 2, "push_workers": 2, "queue_size": 1}
+    piped = run(project(urls, pipeline=pipeline))
+    summary = repo_lists(capsys.readouterr().out)
+    for record in piped.values():
+        if record["outcome"] == "modified":
+            remote_git(record["url"], "branch", "-D", "fix_automata")
+    assert outcomes(piped) == outcomes(run(project(urls)))
+    assert repo_lists(capsys.readouterr().out) == summary
+    assert summary == ["Modified: ['app-0', 'app-2', 'app-4']", "Not Modified: ['app-1', 'app-3']", "Skipped: ['gone']"]
+
+
+@pytest.mark.parametrize("mode", ["worktree", "plumbing"])
+def test_process_pool_matches_the_sequential_run(make_remote, project, mode):
+    # more files than one chunk of pool.map, so results come back from several workers
+    files = dict(APP_FILES, **{f"k8s/cron-{n}.yaml": CRONJOB.replace("name: c", f"name: c{n}") for n in range(9)})
+    url = make_remote("app", files)
+    pooled = run(project([url], commit={"mode": mode}, transform={"file_workers": 2}))
+    pushed = remote_git(url, "rev-parse", "fix_automata:k8s")
+    remote_git(url, "branch", "-D", "fix_automata")
+    sequential = run(project([url], commit={"mode": mode}))
+    assert [(change["path"], change["rules"]) for change in pooled["app"]["files"]] == \
+        [(change["path"], change["rules"]) for change in sequential["app"]["files"]]
+    assert pooled["app"]["rule_changes"] == sequential["app"]["rule_changes"] == {
+        "nonroot": 10, "previlege_escalation": 10, "remove_rootaszero": 10, "upgrade_apis": 10, "vault_command": 10}
+    assert remote_git(url, "rev-parse", "fix_automata:k8s") == pushed
+
+
+def test_plumbing_commits_leave_the_working_tree_alone(make_remote, project, workdir):
+    url = make_remote("app")
+    records = run(project([url], commit={"mode": "plumbing"}))
+    assert records["app"]["outcome"] == "modified"
+    repo = workdir / "temp_repos" / "app"
+    assert (repo / "k8s" / "cron.yaml").read_text() == CRONJOB
+    assert git("status", "--porcelain", cwd=repo) == ""
+    assert git("rev-parse", "--abbrev-ref", "HEAD", cwd=repo).strip() == "main"
+    assert remote_file(url, "fix_automata", "k8s/cron.yaml") != CRONJOB
+
+
+def test_bare_clones_commit_with_plumbing(make_remote, project, workdir):
+    url = make_remote("app")
+    records = run(project([url], clone={"strategy": "bare"}))
+    assert records["app"]["outcome"] == "modified"
+    assert not (workdir / "temp_repos" / "app" / ".git").exists()
+    assert remote_git(url, "diff", "--name-only", "main", "fix_automata").split() == ["k8s/cron.yaml"]
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+import k8zilla_bench
+
+
+def test_import_leaves_heavy_modules_unloaded():
+    code = f"import sys, k8zilla; print(' '.join(m for m in {k8zilla_bench.LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=k8zilla_bench.MODULE_DIR,
+                            check=True, capture_output=True, text=True)
+    assert result.stdout.split() == []
+
+
+def test_startup_within_budget(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    config = k8zilla_bench.MODULE_DIR / "projects.yaml"
+    assert k8zilla_bench.startup_check(str(config), 5)
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+import yaml
+
+import k8zilla
+from conftest import CONFIG_MAP, CRONJOB, HARDENED, PATHWAY, SWITCHES
+
+# a leading comment, documents with and without their own "---", one that
+# changes between two that do not, and a trailing empty document
+MULTI = "# fleet\n" + CONFIG_MAP + "---\n" + CRONJOB + "--- # hardened\n" + HARDENED + "---\n" + CRONJOB + "---\n"
+
+
+@pytest.fixture
+def rules():
+    return k8zilla.compile_rules(SWITCHES, PATHWAY)
+
+
+def harden(path, text, rules, stream_threshold, **options):
+    path.write_text(text)
+    result = k8zilla.transform_file(str(path), rules, stream_threshold=stream_threshold, **options)
+    return result, path.read_text()
+
+
+def leftovers(path):
+    return [name for name in os.listdir(path) if name.endswith(".tmp")]
+
+
+@pytest.mark.parametrize("writer", ["patch", "dump"])
+@pytest.mark.parametrize("analysis", [True, False])
+def test_streaming_matches_the_whole_file(tmp_path, rules, writer, analysis):
+    whole, whole_text = harden(tmp_path / "whole.yaml", MULTI, rules, None, writer=writer, analysis=analysis)
+    streamed, streamed_text = harden(tmp_path / "streamed.yaml", MULTI, rules, 0, writer=writer, analysis=analysis)
+    assert whole["modified"] and streamed["modified"]
+    if writer == "patch":
+        assert streamed_text == whole_text
+    else:
+        # a whole-file dump rewrites every document, streaming only the changed ones
+        assert list(yaml.safe_load_all(streamed_text)) == list(yaml.safe_load_all(whole_text))
+    assert streamed["rules"] == whole["rules"] == {"nonroot": 2, "previlege_escalation": 2, "remove_rootaszero": 2,
+                                                   "upgrade_apis": 2, "vault_command": 2}
+    assert leftovers(tmp_path) == []
+
+
+def test_streaming_keeps_the_file_mode(tmp_path, rules):
+    path = tmp_path / "run.yaml"
+    path.write_text(MULTI)
+    path.chmod(0o640)
+    k8zilla.transform_file(str(path), rules, stream_threshold=0)
+    assert path.stat().st_mode & 0o777 == 0o640
+
+
+def test_unchanged_files_are_not_replaced(tmp_path, rules):
+    path = tmp_path / "cm.yaml"
+    path.write_text(CONFIG_MAP + "---\n" + HARDENED)
+    inode = path.stat().st_ino
+    result = k8zilla.transform_file(str(path), rules, stream_threshold=0)
+    assert not result["modified"]
+    assert path.stat().st_ino == inode
+    assert leftovers(tmp_path) == []
+
+
+def test_a_failing_document_leaves_the_original(tmp_path, rules, monkeypatch):
+    path = tmp_path / "multi.yaml"
+    path.write_text(MULTI)
+    transform_document = k8zilla.transform_document
+
+    def fail_on_the_hardened_one(chunk, *args):
+        if "name: done" in chunk:
+            raise RuntimeError("stopped")
+        return transform_document(chunk, *args)
+    monkeypatch.setattr(k8zilla, "transform_document", fail_on_the_hardened_one)
+    with pytest.raises(RuntimeError):
+        k8zilla.transform_file(str(path), rules, stream_threshold=0)
+    # the changed CronJob before it was only ever in the temp file
+    assert path.read_text() == MULTI
+    assert leftovers(tmp_path) == []
+
+
+def test_streamed_files_use_the_transform_cache(tmp_path, rules):
+    cache = k8zilla.transform_cache_settings({"path": str(tmp_path / "cache")}, SWITCHES, PATHWAY, "patch")
+    first, first_text = harden(tmp_path / "a.yaml", MULTI, rules, 0, transform_cache=cache)
+    second, second_text = harden(tmp_path / "b.yaml", MULTI, rules, 0, transform_cache=cache)
+    assert (first["cache"], second["cache"]) == ("miss", "hit")
+    assert second["rules"] == first["rules"]
+    assert second_text == first_text
+    # a whole-file transform of the same bytes finds the streamed entry too
+    whole, whole_text = harden(tmp_path / "c.yaml", MULTI, rules, None, transform_cache=cache)
+    assert whole["cache"] == "hit" and whole_text == first_text
+
+
+def test_stream_threshold_for():
+    assert k8zilla.stream_threshold_for({"streaming": "on"}) == 0
+    assert k8zilla.stream_threshold_for({"streaming": "off"}) is None
+    assert k8zilla.stream_threshold_for({"stream_threshold_mb": 0.5}) == 512 * 1024
+
+
+def test_write_atomically_appends_the_source(tmp_path):
+    path, source = tmp_path / "entry", tmp_path / "body"
+    source.write_bytes(b"body")
+    k8zilla.write_atomically(str(path), b"head\n", str(source))
+    assert path.read_bytes() == b"head\nbody"
+    assert leftovers(tmp_path) == []
@@ -0,0 +1,62 @@
+import pytest
+
+import k8zilla
+from conftest import CONFIG_MAP, CRONJOB, PATHWAY, SWITCHES, remote_file, remote_git, run
+
+
+@pytest.mark.parametrize("streaming", ["on", "off"])
+def test_transform_cache_hits_keep_rule_counts(make_remote, project, tmp_path, streaming):
+    url = make_remote("app")
+    config = project([url], transform={"streaming": streaming},
+                     transform_cache={"enabled": "on", "path": str(tmp_path / "transform_cache")})
+    first = run(config)["app"]
+    remote_git(url, "branch", "-D", "fix_automata")
+    second = run(config)["app"]
+    assert {change["cache"] for change in first["files"]} == {"miss"}
+    assert {change["cache"] for change in second["files"]} == {"hit"}
+    assert second["rule_changes"] == first["rule_changes"]
+    assert remote_file(url, "fix_automata", "k8s/cron.yaml") != CRONJOB
+
+
+def cache_settings(tmp_path, switches=SWITCHES, **transform_cache):
+    transform_cache = dict({"path": str(tmp_path / "transform_cache")}, **transform_cache)
+    return k8zilla.transform_cache_settings(transform_cache, switches, PATHWAY, "patch")
+
+
+def transform(data, cache, switches=SWITCHES):
+    rules = k8zilla.compile_rules(switches, PATHWAY)
+    return k8zilla.transform_file("manifest.yaml", rules, k8zilla.make_yaml(), cache, data=data, write=False)
+
+
+@pytest.mark.parametrize("text", [CRONJOB, CONFIG_MAP])
+def test_hits_return_what_the_miss_computed(tmp_path, text):
+    cache = cache_settings(tmp_path)
+    miss = transform(text.encode(), cache)
+    hit = transform(text.encode(), cache)
+    assert (miss["cache"], hit["cache"]) == ("miss", "hit")
+    assert hit["modified"] == miss["modified"]
+    assert hit.get("output") == miss.get("output")
+
+
+def test_other_switches_miss(tmp_path):
+    transform(CRONJOB.encode(), cache_settings(tmp_path))
+    other = dict(SWITCHES, nonroot="off")
+    assert transform(CRONJOB.encode(), cache_settings(tmp_path, other), other)["cache"] == "miss"
+
+
+def test_clear_empties_the_cache_before_the_run(make_remote, project, tmp_path):
+    url = make_remote("app")
+    cache = {"enabled": "on", "path": str(tmp_path / "transform_cache")}
+    run(project([url], transform_cache=cache))
+    remote_git(url, "branch", "-D", "fix_automata")
+    records = run(project([url], transform_cache=dict(cache, clear="on")))
+    assert {change["cache"] for change in records["app"]["files"]} == {"miss"}
+    # the entries of this run are kept for the next one
+    assert list((tmp_path / "transform_cache").iterdir())
+
+
+def test_oldest_entries_are_evicted_over_max_size(tmp_path):
+    cache = cache_settings(tmp_path, max_size_mb=0)
+    transform(CRONJOB.encode(), cache)
+    k8zilla.evict_transform_cache(cache)
+    assert transform(CRONJOB.encode(), cache)["cache"] == "miss"
@@ -0,0 +1,65 @@
+import pytest
+
+import k8zilla
+from conftest import CRONJOB, PATHWAY, SWITCHES, run
+
+FLOW = """apiVersion: v1
+kind: Pod
+metadata:
+  name: p
+spec:
+  containers:
+    - {name: a, image: nginx, securityContext: {runAsUser: 0}}
+"""
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return k8zilla.compile_rules(SWITCHES, PATHWAY)
+
+
+def harden(text, rules, writer):
+    result = k8zilla.transform_file("manifest.yaml", rules, k8zilla.make_yaml(), writer=writer, data=text.encode(),
+                                    write=False)
+    return result["output"].decode()
+
+
+def test_patch_only_touches_changed_lines(rules):
+    assert harden(CRONJOB, rules, "patch") == """apiVersion: batch/v1
+kind: CronJob
+metadata:
+  name: c  # keep me
+spec:
+  schedule: "* * * * *"
+  jobTemplate:
+    spec:
+      template:
+        spec:
+          containers:
+            - name: a
+              image: vault:1
+              securityContext:
+                runAsNonRoot: true
+                allowPrivilegeEscalation: false
+              command: ["vault"]
+"""
+
+
+@pytest.mark.parametrize("text", [CRONJOB, FLOW])
+def test_writers_agree_on_the_data(rules, text):
+    # the flow mapping cannot be patched in place and falls back to a dump
+    yaml = k8zilla.make_yaml()
+    assert yaml.load(harden(text, rules, "patch")) == yaml.load(harden(text, rules, "dump"))
+
+
+def test_flow_mappings_fall_back_to_a_dump(rules):
+    hardened = k8zilla.make_yaml().load(harden(FLOW, rules, "patch"))
+    assert hardened["spec"]["containers"][0]["securityContext"] == {"runAsNonRoot": True,
+                                                                    "allowPrivilegeEscalation": False}
+
+
+@pytest.mark.parametrize("writer", ["patch", "dump"])
+def test_writers_change_the_same_files(make_remote, project, writer):
+    url = make_remote("app")
+    records = run(project([url], transform={"writer": writer}))
+    assert [change["path"] for change in records["app"]["files"]] == ["k8s/cron.yaml"]